@@ -10,3 +10,9 @@ Appropriate:  Your google code for adwords.
 Inappropriate: The keyedcache timeout for the store.
 
 """
+
+
+def preload(sites=None):
+    """Load the registry and the settings before forking workers, see `functions.preload`."""
+    from livesettings.functions import preload
+    return preload(sites=sites)
@@ -0,0 +1,17 @@
+"""The urls of livesettings with the async variants of the editor and export views, for ASGI servers."""
+try:
+    from django.urls import re_path
+except ImportError:
+    from django.conf.urls import url as re_path
+
+from livesettings import views
+
+urlpatterns = [
+    re_path(r'^$', views.asite_settings, name='satchmo_site_settings'),
+    re_path(r'^export/$', views.aexport_as_python, name='settings_export'),
+    re_path(r'^api/save/$', views.save_values, name='livesettings_save'),
+    re_path(r'^api/json/$', views.settings_json, name='livesettings_json'),
+    re_path(r'^api/json/(?P<group>[^/]+)/$', views.settings_json, name='livesettings_json_group'),
+    re_path(r'^(?P<group>[^/]+)/$', views.agroup_settings, name='livesettings_group'),
+    re_path(r'^(?P<group>[^/]+)/fragment/$', views.group_fragment, name='livesettings_group_fragment'),
+]
@@ -0,0 +1,170 @@
+"""Invalidate the caches of the sibling processes of a host when a setting is saved.
+
+With LIVESETTINGS_BROADCAST_DIR set, every process binds a Unix datagram
+socket in that directory and listens on it in a daemon thread.  Saving a
+setting sends the changed (site_id, group, key) to the sockets of the other
+processes after the transaction is committed, and they delete those cache
+entries and start a new local settings revision.  No process waits for the
+others: a datagram which can not be delivered immediately is dropped, the
+entry then expires with the cache timeout.
+
+Processes serving requests start listening on their first request, others
+call `start()`.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+
+from django.conf import settings as djangosettings
+from django.core.signals import request_started
+
+__all__ = ['Listener', 'publish', 'start', 'stop']
+
+log = logging.getLogger('configuration.broadcast')
+
+# changes per datagram, well below the default socket buffers
+BATCH = 100
+SUFFIX = '.sock'
+
+
+def _directory():
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    return getattr(djangosettings, 'LIVESETTINGS_BROADCAST_DIR', None)
+
+
+class Listener(threading.Thread):
+    """Daemon thread which receives the changes published by the other processes."""
+
+    def __init__(self, directory, name=None):
+        super(Listener, self).__init__(name='livesettings-broadcast', daemon=True)
+        self.pid = os.getpid()
+        self.path = os.path.join(directory, '%s%s' % (name or self.pid, SUFFIX))
+        self.stopped = False
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            self.sock.bind(self.path)
+        except OSError:
+            # left by a dead process with the same pid
+            os.remove(self.path)
+            self.sock.bind(self.path)
+
+    def run(self):
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except OSError:
+                data = None
+            if self.stopped:
+                return
+            if data is None:
+                log.error('Can not receive the settings broadcast in %s', self.path)
+                return
+            try:
+                changes = [tuple(change) for change in json.loads(data)]
+            except (ValueError, TypeError):
+                log.warning('Ignoring a malformed settings broadcast in %s', self.path)
+                continue
+            try:
+                self.invalidate(changes)
+            except Exception:
+                log.exception('Could not invalidate the settings %s', changes)
+
+    def invalidate(self, changes):
+        from livesettings.cache import get_cache
+        from livesettings.models import bump_settings_revision, setting_cache_keys
+        get_cache().delete_many(list(setting_cache_keys(changes).values()))
+        bump_settings_revision()
+        log.debug('Invalidated %s settings changed by another process', len(changes))
+
+    def stop(self):
+        self.stopped = True
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        # shutdown wakes up the blocking recv
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+_listener = None
+_lock = threading.Lock()
+
+
+def start(**kwargs):
+    """Start listening in this process, unless it does or there is no LIVESETTINGS_BROADCAST_DIR."""
+    global _listener
+    directory = _directory()
+    if not directory:
+        return None
+    listener = _listener
+    if listener is not None and listener.pid == os.getpid():
+        return listener
+    with _lock:
+        if _listener is None or _listener.pid != os.getpid():
+            # a listener of the parent process did not survive the fork
+            try:
+                listener = Listener(directory)
+            except OSError as e:
+                from livesettings.models import _warn_once
+                _warn_once('livesettings_broadcast', 'Can not listen to settings broadcasts in %s: %s'
+                           % (directory, e))
+                return None
+            listener.start()
+            _listener = listener
+        return _listener
+
+
+def stop():
+    """Stop listening in this process."""
+    global _listener
+    with _lock:
+        if _listener is not None and _listener.pid == os.getpid():
+            _listener.stop()
+        _listener = None
+
+
+def publish(changes):
+    """Send the changed (site_id, group, key) to the other processes of the host."""
+    directory = _directory()
+    if not directory or not changes:
+        return
+    own = _listener.path if _listener is not None and _listener.pid == os.getpid() else None
+    changes = [list(change) for change in changes]
+    datagrams = [json.dumps(changes[i:i + BATCH]).encode('utf-8') for i in range(0, len(changes), BATCH)]
+
+    try:
+        names = os.listdir(directory)
+    except OSError as e:
+        log.warning('Can not broadcast the settings changes to %s: %s', directory, e)
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    try:
+        for name in names:
+            path = os.path.join(directory, name)
+            if not name.endswith(SUFFIX) or path == own:
+                continue
+            try:
+                for datagram in datagrams:
+                    sock.sendto(datagram, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # the process is gone
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            except OSError as e:
+                # e.g. BlockingIOError, its queue is full
+                log.debug('Can not broadcast the settings changes to %s: %s', path, e)
+    finally:
+        sock.close()
+
+
+request_started.connect(start)
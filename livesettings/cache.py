@@ -0,0 +1,322 @@
+"""The cache of the stored settings.
+
+Settings are cached under tuples starting with ``(site_id, group, key)``,
+with None for a setting known not to exist.  The backend is chosen by the
+LIVESETTINGS_CACHE_BACKEND setting, the dotted path of a `BaseCache`
+subclass, and created with the keyword arguments in
+LIVESETTINGS_CACHE_OPTIONS:
+
+- `KeyedCache` (the default) uses django-keyedcache, like earlier versions.
+- `DjangoCache` uses a Django cache directly, the ``alias`` option names it.
+- `LocalCache` keeps ``max_entries`` settings in this process, least
+  recently used first out.  Other processes only see changes through the
+  change log or the broadcast.
+
+The token of the settings revision is the entry `REVISION`, so it can be
+read in the same round trip as the settings.
+
+The backends do not depend on the rest of livesettings, so each one can be
+created and timed on its own.
+"""
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings as djangosettings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.utils.module_loading import import_string
+
+__all__ = ['REVISION', 'BaseCache', 'KeyedCache', 'DjangoCache', 'LocalCache', 'get_cache']
+
+DEFAULT_BACKEND = 'livesettings.cache.KeyedCache'
+
+REVISION = ('revision',)
+
+
+class BaseCache(object):
+    """The interface of the settings cache backends.
+
+    `get_many` returns only the cached keys, so a cached None is different
+    from a missing entry.
+    """
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys):
+        raise NotImplementedError
+
+    def set_many(self, entries):
+        raise NotImplementedError
+
+    def delete_many(self, keys):
+        raise NotImplementedError
+
+    def add(self, key, value):
+        """Cache value unless key is cached, return the cached value; the first writer wins."""
+        cached = self.get_many([key])
+        if key in cached:
+            return cached[key]
+        self.set_many({key: value})
+        return value
+
+    def revision(self, bump=False):
+        """Return the token of the current settings revision, a new one if there is none or bump is True."""
+        revision = None if bump else self.get(REVISION)
+        if revision is None:
+            revision = uuid.uuid4().hex
+            self.set_many({REVISION: revision})
+        return revision
+
+    def clear(self):
+        raise NotImplementedError
+
+    async def aget_many(self, keys):
+        return await sync_to_async(self.get_many)(keys)
+
+    async def aset_many(self, entries):
+        await sync_to_async(self.set_many)(entries)
+
+    async def aadd(self, key, value):
+        return await sync_to_async(self.add)(key, value)
+
+    async def arevision(self):
+        return await sync_to_async(self.revision)()
+
+
+class KeyedCache(BaseCache):
+    """The keyedcache entries ``Setting::site::group::key...`` and ``Setting::revision``."""
+
+    def __init__(self):
+        import keyedcache
+        self.keyedcache = keyedcache
+
+    def _key(self, key):
+        return self.keyedcache.cache_key(('Setting',) + tuple(key))
+
+    def _unwrap(self, keys, entries):
+        found = {}
+        for key in keys:
+            obj = entries.get(self._key(key))
+            # like cache_get, entries still being computed are not returned
+            if isinstance(obj, self.keyedcache.CacheWrapper) and not obj.inprocess:
+                found[key] = obj.val
+        return found
+
+    def _wrap(self, entries):
+        wrapped = {}
+        for key, value in entries.items():
+            ck = self._key(key)
+            self.keyedcache.CACHED_KEYS[ck] = True
+            wrapped[ck] = self.keyedcache.CacheWrapper.wrap(value)
+        return wrapped
+
+    def get_many(self, keys):
+        if not self.keyedcache.cache_enabled():
+            return {}
+        return self._unwrap(keys, self.keyedcache.cache.get_many([self._key(key) for key in keys]))
+
+    def set_many(self, entries):
+        if self.keyedcache.cache_enabled() and entries:
+            self.keyedcache.cache.set_many(self._wrap(entries), self.keyedcache.CACHE_TIMEOUT)
+
+    def delete_many(self, keys):
+        if not self.keyedcache.cache_enabled() or not keys:
+            return
+        cks = [self._key(key) for key in keys]
+        self.keyedcache.cache.delete_many(cks)
+        for ck in cks:
+            self.keyedcache.CACHED_KEYS.pop(ck, None)
+
+    def add(self, key, value):
+        if not self.keyedcache.cache_enabled():
+            return value
+        ck = self._key(key)
+        if self.keyedcache.cache.add(ck, self.keyedcache.CacheWrapper.wrap(value), self.keyedcache.CACHE_TIMEOUT):
+            self.keyedcache.CACHED_KEYS[ck] = True
+            return value
+        return self.get(key, value)
+
+    def clear(self):
+        self.keyedcache.cache_delete()
+
+    async def aget_many(self, keys):
+        cache = self.keyedcache.cache
+        if not self.keyedcache.cache_enabled():
+            return {}
+        if not hasattr(cache, 'aget_many'):
+            return await super(KeyedCache, self).aget_many(keys)
+        return self._unwrap(keys, await cache.aget_many([self._key(key) for key in keys]))
+
+    async def aset_many(self, entries):
+        cache = self.keyedcache.cache
+        if not self.keyedcache.cache_enabled() or not entries:
+            return
+        if not hasattr(cache, 'aset_many'):
+            return await super(KeyedCache, self).aset_many(entries)
+        await cache.aset_many(self._wrap(entries), self.keyedcache.CACHE_TIMEOUT)
+
+
+class DjangoCache(BaseCache):
+    """A Django cache, without keyedcache's wrappers.
+
+    The keys are ``prefix:site:group:key...``, hashed if they would be too long
+    or contain characters memcached does not allow.  The timeout is the
+    default of the cache unless given.
+    """
+
+    def __init__(self, alias=DEFAULT_CACHE_ALIAS, prefix='livesettings', timeout=None):
+        self.cache = caches[alias]
+        self.prefix = prefix
+        self.timeout = timeout if timeout is not None else self.cache.default_timeout
+        self.revision_key = self._key(REVISION)
+
+    def _key(self, key):
+        ck = ':'.join(str(part) for part in (self.prefix,) + tuple(key))
+        if len(ck) > 200 or any(c <= ' ' or c == '\x7f' for c in ck):
+            ck = '%s:%s' % (self.prefix, hashlib.md5(ck.encode('utf-8')).hexdigest())
+        return ck
+
+    def get_many(self, keys):
+        cks = dict((self._key(key), key) for key in keys)
+        return dict((cks[ck], value) for ck, value in self.cache.get_many(list(cks)).items())
+
+    def set_many(self, entries):
+        if entries:
+            self.cache.set_many(dict((self._key(key), value) for key, value in entries.items()), self.timeout)
+
+    def delete_many(self, keys):
+        if keys:
+            self.cache.delete_many([self._key(key) for key in keys])
+
+    def add(self, key, value):
+        if self.cache.add(self._key(key), value, self.timeout):
+            return value
+        return self.get(key, value)
+
+    def revision(self, bump=False):
+        revision = None if bump else self.cache.get(self.revision_key)
+        if revision is None:
+            revision = uuid.uuid4().hex
+            self.cache.set(self.revision_key, revision, self.timeout)
+        return revision
+
+    def clear(self):
+        self.cache.clear()
+
+    async def aget_many(self, keys):
+        if not hasattr(self.cache, 'aget_many'):
+            return await super(DjangoCache, self).aget_many(keys)
+        cks = dict((self._key(key), key) for key in keys)
+        return dict((cks[ck], value) for ck, value in (await self.cache.aget_many(list(cks))).items())
+
+    async def aset_many(self, entries):
+        if not hasattr(self.cache, 'aset_many'):
+            return await super(DjangoCache, self).aset_many(entries)
+        if entries:
+            await self.cache.aset_many(dict((self._key(key), value) for key, value in entries.items()), self.timeout)
+
+    async def arevision(self):
+        if not hasattr(self.cache, 'aget'):
+            return await super(DjangoCache, self).arevision()
+        revision = await self.cache.aget(self.revision_key)
+        if revision is None:
+            revision = await sync_to_async(self.revision)()
+        return revision
+
+
+class LocalCache(BaseCache):
+    """A least recently used cache in this process, with an optional timeout in seconds."""
+
+    def __init__(self, max_entries=1000, timeout=None):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self._revision = None
+
+    def get_many(self, keys):
+        found = {}
+        now = time.monotonic()
+        with self.lock:
+            for key in keys:
+                if key == REVISION:
+                    if self._revision is not None:
+                        found[key] = self._revision
+                    continue
+                try:
+                    value, expires = self.entries[key]
+                except KeyError:
+                    continue
+                if expires is not None and expires <= now:
+                    del self.entries[key]
+                    continue
+                self.entries.move_to_end(key)
+                found[key] = value
+        return found
+
+    def set_many(self, entries):
+        expires = None if self.timeout is None else time.monotonic() + self.timeout
+        with self.lock:
+            for key, value in entries.items():
+                self.entries[key] = (value, expires)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def add(self, key, value):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > now):
+                self.entries.move_to_end(key)
+                return entry[0]
+            self.entries[key] = (value, None if self.timeout is None else now + self.timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def revision(self, bump=False):
+        if bump or self._revision is None:
+            self._revision = uuid.uuid4().hex
+        return self._revision
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        self._revision = None
+
+    async def aget_many(self, keys):
+        return self.get_many(keys)
+
+    async def aset_many(self, entries):
+        self.set_many(entries)
+
+    async def aadd(self, key, value):
+        return self.add(key, value)
+
+    async def arevision(self):
+        return self.revision()
+
+
+# ((backend path, options), backend), replaced as a whole
+_backend = (None, None)
+
+
+def get_cache():
+    """Return the backend configured by LIVESETTINGS_CACHE_BACKEND, created once per configuration."""
+    global _backend
+    config = (getattr(djangosettings, 'LIVESETTINGS_CACHE_BACKEND', DEFAULT_BACKEND),
+              getattr(djangosettings, 'LIVESETTINGS_CACHE_OPTIONS', {}))
+    if _backend[0] != config:
+        _backend = (config, import_string(config[0])(**config[1]))
+    return _backend[1]
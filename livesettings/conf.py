@@ -0,0 +1,176 @@
+"""Attribute access to configuration values.
+
+    from livesettings import conf
+
+    currency = conf.SHOP.CURRENCY
+
+is the same as ``config_value('SHOP', 'CURRENCY')``, but the namespace
+classes are generated from the registry with one descriptor per value, and
+the typed values are memoized until the settings revision changes.  The
+revision is checked once per request, and immediately after this process
+changes a setting.  Outside of requests (management commands, workers)
+call `refresh()` to see changes made by other processes.
+"""
+import logging
+
+from django.core.signals import request_started, setting_changed
+
+from livesettings import signals
+from livesettings.functions import ConfigurationSettings, config_value
+from livesettings.models import settings_revision, _safe_get_siteid
+from livesettings.values import get_language
+
+__all__ = ['settings', 'refresh']
+
+log = logging.getLogger('configuration.conf')
+
+
+class Resolver(object):
+    """Memo of typed values for one settings revision of the current site.
+
+    The revision state and its values are one tuple, replaced by a single
+    assignment, so a thread never reads values of another revision.
+    """
+
+    def __init__(self):
+        self.memo = (None, {})
+        self.stale = True
+
+    @property
+    def state(self):
+        return self.memo[0]
+
+    @property
+    def values(self):
+        return self.memo[1]
+
+    def mark_stale(self, **kwargs):
+        self.stale = True
+
+    def validate(self):
+        self.stale = False
+        state = (settings_revision(), ConfigurationSettings().generation, _safe_get_siteid(None))
+        if state != self.memo[0]:
+            self.memo = (state, {})
+
+    def install(self, state, values):
+        """Replace the memo by values of (revision, generation, siteid) = state, e.g. from the refresher."""
+        self.memo = (state, dict(values))
+        self.stale = False
+
+    def get(self, k):
+        """Return the value of k = (group, key)."""
+        if self.stale:
+            self.validate()
+        values = self.memo[1]
+        try:
+            return values[k]
+        except KeyError:
+            value = values[k] = config_value(*k)
+            return value
+
+    def get_localized(self, k):
+        """Return the value of k = (group, key) in the current language."""
+        return self.get(k + (get_language(),))
+
+
+resolver = Resolver()
+request_started.connect(resolver.mark_stale)
+setting_changed.connect(resolver.mark_stale)
+signals.settings_revision_changed.connect(resolver.mark_stale)
+
+
+class ValueDescriptor(object):
+    """Class attribute which reads one registered value through the resolver."""
+
+    def __init__(self, cfg):
+        self.key = (cfg.group.key, cfg.key)
+        self.cfg = cfg
+        self.resolve = resolver.get_localized if cfg.localized else resolver.get
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return self.resolve(self.key)
+
+    def __set__(self, instance, value):
+        raise AttributeError("Configuration values are read-only, use Value.update() to change %s.%s" % self.key)
+
+
+def _is_public(name):
+    return not name.startswith('_')
+
+
+class GroupNamespace(object):
+    """The values of one `ConfigurationGroup`, as attributes."""
+
+    def __init__(self, group):
+        self._group = group
+
+    def __getattr__(self, name):
+        # only reached for keys registered after the namespace was built
+        if settings._rebuild():
+            return getattr(getattr(settings, self._group.key), name)
+        raise AttributeError("%s has no value %s" % (self._group.key, name))
+
+    def __iter__(self):
+        return iter(k for k, v in type(self).__dict__.items() if isinstance(v, ValueDescriptor))
+
+    def __repr__(self):
+        return '<GroupNamespace %s>' % self._group.key
+
+
+class SettingsNamespace(object):
+    """All registered groups, as attributes.
+
+    The class of the instance is replaced whenever a value is registered, so the
+    attribute lookup of a known group and key never leaves the type dictionaries.
+    """
+
+    _generation = None
+
+    def _rebuild(self):
+        """Regenerate the namespace classes if the registry changed, return True if it did."""
+        mgr = ConfigurationSettings()
+        if mgr.generation == self._generation:
+            return False
+
+        attrs = {'_generation': mgr.generation}
+        for group in mgr.settings.values():
+            if not _is_public(group.key):
+                continue
+            group_attrs = {}
+            for cfg in group._dict.values():
+                if _is_public(cfg.key):
+                    group_attrs[cfg.key] = ValueDescriptor(cfg)
+            cls = type('%sNamespace' % group.key, (GroupNamespace,), group_attrs)
+            attrs[group.key] = cls(group)
+
+        self.__class__ = type('SettingsNamespace', (SettingsNamespace,), attrs)
+        log.debug('Rebuilt the settings namespace for registry generation %s', mgr.generation)
+        return True
+
+    def __getattr__(self, name):
+        if _is_public(name) and self._rebuild():
+            return getattr(self, name)
+        raise AttributeError("No configuration group %s" % name)
+
+    def __iter__(self):
+        self._rebuild()
+        return iter(k for k, v in type(self).__dict__.items() if isinstance(v, GroupNamespace))
+
+    def __repr__(self):
+        return '<SettingsNamespace>'
+
+
+settings = SettingsNamespace()
+
+
+def refresh():
+    """Check the settings revision again on the next access."""
+    resolver.mark_stale()
+
+
+def __getattr__(name):
+    # `livesettings.conf.GROUP` is `livesettings.conf.settings.GROUP`
+    return getattr(settings, name)
@@ -1,3 +1,4 @@
+import copy
 import logging
 
 from django import forms
@@ -9,37 +10,60 @@ class SettingsEditor(forms.Form):
     "Base editor, from which customized forms are created"
 
     def __init__(self, *args, **kwargs):
-        from livesettings.values import ConfigurationGroup
+        from livesettings.values import load_raw_values
 
         settings = kwargs.pop('settings')
+        raw_values = kwargs.pop('raw_values', None)
         super(SettingsEditor, self).__init__(*args, **kwargs)
-        flattened = []
-        groups = []
-        for setting in settings:
-            if isinstance(setting, ConfigurationGroup):
-                for s in setting:
-                    flattened.append(s)
-            else:
-                flattened.append(setting)
+        candidates = self._candidates(settings)
+
+        # Load the current values, and the values which enable them, in one batch,
+        # unless the raw values of `values_needed(settings)` are given
+        if raw_values is None:
+            raw_values = load_raw_values(self.values_needed(settings))
 
-        for setting in flattened:
+        groups = []
+        group_keys = set()
+        for setting, check_enabled in candidates:
+            if check_enabled and not setting.enabled(raw_values):
+                continue
             # Add the field to the customized field list
-            kw = {
-                'label': setting.description,
-                'help_text': setting.help_text,
-                # Provide current setting values for initializing the form
-                'initial': setting.editor_value
-            }
-            field = setting.make_field(**kw)
+            field = copy.deepcopy(setting.field_prototype())
+            # Provide current setting values for initializing the form
+            field.initial = setting.to_editor(raw_values[(setting.group.key, setting.key)])
 
             k = '%s__%s' % (setting.group.key, setting.key)
             self.fields[k] = field
-            if not setting.group in groups:
+            if not setting.group.key in group_keys:
+                group_keys.add(setting.group.key)
                 groups.append(setting.group)
                 # log.debug("Added field: %s = %s" % (k, str(field)))
 
         self.groups = groups
 
+    @staticmethod
+    def _candidates(settings):
+        """Return (value, whether it is shown only when enabled) of the edited settings."""
+        from livesettings.values import ConfigurationGroup, SortedDotDict
+
+        candidates = []
+        for setting in settings:
+            if isinstance(setting, ConfigurationGroup):
+                candidates.extend((s, True) for s in SortedDotDict.values(setting))
+            else:
+                candidates.append((setting, False))
+        return candidates
+
+    @classmethod
+    def values_needed(cls, settings):
+        """Return the values whose raw values the editor of settings needs, see `raw_values`."""
+        needed = {}
+        for setting, check_enabled in cls._candidates(settings):
+            needed[(setting.group.key, setting.key)] = setting
+            if setting.requires:
+                needed[(setting.requires.group.key, setting.requires.key)] = setting.requires
+        return list(needed.values())
+
 
 class LocalizedChoiceField(forms.ChoiceField):
     def __init__(self, *args, **kwargs):
@@ -1,14 +1,19 @@
 import logging
+from collections import OrderedDict as SortedDict
 
 from django.utils.translation import gettext
 from livesettings import values
-from livesettings.models import SettingNotSet
-from livesettings.utils import is_string_like
+from livesettings.models import SettingNotSet, find_settings, namespaces, settings_revision, _safe_get_siteid
+from livesettings.overrides import get_overrides
+from livesettings.utils import is_string_like, is_list_or_tuple, unique as unique_list
 
 log = logging.getLogger('configuration')
 
 _NOTSET = object()
 
+# (revision, {lookup: values}) memo of config_collect_values
+_collected = (None, {})
+
 
 class ConfigurationSettings(object):
     """A singleton manager for ConfigurationSettings"""
@@ -18,6 +23,8 @@ class ConfigurationSettings(object):
             self.settings = values.SortedDotDict()
             self.super_groups = list()
             self.prereg = {}
+            # bumped whenever a value is registered
+            self.generation = 0
 
         def __getitem__(self, key):
             """Get an element either by ConfigurationGroup object or by its key"""
@@ -92,16 +99,25 @@ class ConfigurationSettings(object):
 
         def preregister_choice(self, group, key, choice):
             """Setup a choice for a group/key which hasn't been instantiated yet."""
+            self.preregister_choices(group, key, (choice,))
+
+        def preregister_choices(self, group, key, choices):
+            """Setup several choices for a group/key which hasn't been instantiated yet."""
             k = (group, key)
-            if k in self.prereg:
-                self.prereg[k].append(choice)
-            else:
-                self.prereg[k] = [choice]
+            with values.registry_lock:
+                prereg = self.prereg.get(k)
+                if prereg is None:
+                    prereg = self.prereg[k] = SortedDict()
+                for choice in choices:
+                    if not is_list_or_tuple(choice):
+                        choice = (choice, choice)
+                    prereg.setdefault(choice[0], choice)
 
         def register_super_group(self, super_group):
             """Registers the super group"""
-            if super_group not in self.super_groups:
-                self.super_groups.append(super_group)
+            with values.registry_lock:
+                if super_group not in self.super_groups:
+                    self.super_groups = self.super_groups + [super_group]
 
         def register(self, value):
             g = value.group
@@ -112,14 +128,17 @@ class ConfigurationSettings(object):
             valuekey = value.key
 
             k = (groupkey, valuekey)
-            if k in self.prereg:
-                for choice in self.prereg[k]:
-                    value.add_choice(choice)
+            with values.registry_lock:
+                if k in self.prereg:
+                    value.add_choices(list(self.prereg[k].values()))
 
-            if not groupkey in self.settings:
-                self.settings[groupkey] = g
+                if not groupkey in self.settings:
+                    self.settings[groupkey] = g
 
-            self.settings[groupkey][valuekey] = value
+                self.settings[groupkey][valuekey] = value
+                namespaces.define(value)
+                # after the value, so a reader who sees the generation sees the value
+                self.generation += 1
 
             return value
 
@@ -139,6 +158,12 @@ class ConfigurationSettings(object):
     def __getitem__(self, key):
         return self.__instance[key]
 
+    def __contains__(self, key):
+        return key in self.__instance
+
+    def __iter__(self):
+        return iter(self.__instance)
+
     def __len__(self):
         return len(self.__instance)
 
@@ -181,25 +206,42 @@ def config_collect_values(group, groupkey, key, unique=True, skip_missing=True):
     Stage 2: config_value('PAYMENT_GOOGLE', 'CREDITCHOICES')
            + config_value('PAYMENT_AUTHORIZENET', 'CREDITCHOICES')
     Stage 3: (if unique is true) remove dupes
+
+    Stage 2 is a single batched lookup and the result is memoized until the
+    settings revision changes.
     """
+    global _collected
+    if isinstance(group, values.ConfigurationGroup):
+        group = group.key
+
+    use_db, overrides = get_overrides()
+    memo = None
+    if use_db:
+        revision = (settings_revision(), ConfigurationSettings().generation)
+        if _collected[0] != revision:
+            _collected = (revision, {})
+        memo = _collected[1]
+        memo_key = (_safe_get_siteid(None), values.get_language(), group, groupkey, key, unique, skip_missing)
+        if memo_key in memo:
+            return list(memo[memo_key])
+
     groups = config_value(group, groupkey)
 
+    keys = [(g, key) for g in groups]
+    found = config_values_many(keys, skip_missing=True)
     ret = []
-    for g in groups:
-        try:
-            ret.append(config_value(g, key))
-        except KeyError as ke:
-            if not skip_missing:
-                raise SettingNotSet('No config %s.%s' % (g, key))
+    for k in keys:
+        if k in found:
+            ret.append(found[k])
+        elif not skip_missing:
+            raise SettingNotSet('No config %s.%s' % k)
 
     if unique:
-        out = []
-        for x in ret:
-            if not x in out:
-                out.append(x)
-        ret = out
+        ret = unique_list(ret)
 
-    return ret
+    if memo is not None:
+        memo[memo_key] = ret
+    return list(ret)
 
 
 def config_register(value):
@@ -228,6 +270,51 @@ def config_value(group, key, default=_NOTSET):
         raise
 
 
+async def aconfig_value(group, key, default=_NOTSET):
+    """Get a value from the configuration system, in async code"""
+    try:
+        cfg = config_get(group, key)
+    except SettingNotSet:
+        if default != _NOTSET:
+            return default
+        raise
+    raw = await values.aload_raw_values([cfg])
+    return cfg.to_python(raw[(cfg.group.key, cfg.key)])
+
+
+def _configs_many(keys, skip_missing):
+    mgr = ConfigurationSettings()
+    cfgs = {}
+    for group, key in keys:
+        if isinstance(group, values.ConfigurationGroup):
+            group = group.key
+        try:
+            cfgs[(group, key)] = mgr.get_config(group, key)
+        except SettingNotSet:
+            if not skip_missing:
+                raise
+    return cfgs
+
+
+def config_values_many(keys, skip_missing=False):
+    """Get several values from the configuration system with one batched lookup.
+
+    `keys` is an iterable of (group, key) pairs, returns a dict mapping each
+    pair to its value.  Pairs which are not registered raise SettingNotSet,
+    or are left out if `skip_missing` is true.
+    """
+    cfgs = _configs_many(keys, skip_missing)
+    raw = values.load_raw_values(list(cfgs.values()))
+    return dict((k, cfg.to_python(raw[(cfg.group.key, cfg.key)])) for k, cfg in cfgs.items())
+
+
+async def aconfig_values_many(keys, skip_missing=False):
+    """Async `config_values_many`"""
+    cfgs = _configs_many(keys, skip_missing)
+    raw = await values.aload_raw_values(list(cfgs.values()))
+    return dict((k, cfg.to_python(raw[(cfg.group.key, cfg.key)])) for k, cfg in cfgs.items())
+
+
 def config_value_safe(group, key, default_value):
     """Get a config value with a default fallback, safe for use during SyncDB."""
     raw = default_value
@@ -260,10 +347,70 @@ def config_choice_values(group, key, skip_missing=True, translate=False):
     return choices
 
 
-def config_add_choice(group, key, choice):
-    """Add a choice to a value"""
+def config_add_choice(group, key, *choices):
+    """Add one or more choices to a value"""
     if config_exists(group, key):
         cfg = config_get(group, key)
-        cfg.add_choice(choice)
+        cfg.add_choices(choices)
     else:
-        ConfigurationSettings().preregister_choice(group, key, choice)
+        ConfigurationSettings().preregister_choices(group, key, choices)
+
+
+_fork_hook_registered = False
+
+
+def _after_fork():
+    """Check the settings revision again in a forked process."""
+    from livesettings import conf
+    from livesettings.snapshot import shared_snapshots
+    conf.refresh()
+    shared_snapshots.mark_stale()
+
+
+def preload(sites=None):
+    """Load the registry and the settings of the sites in this process.
+
+    Meant for the master process of a preforking server (e.g. ``gunicorn
+    --preload``) after Django is set up and before the workers are forked:
+    they then share the loaded objects copy-on-write instead of each loading
+    them on its first request.  Calling it in a worker, e.g. from a post_fork
+    hook, shares nothing.  `sites` is a list of Site objects or ids, the
+    current site by default.  The database connections are closed, so the
+    workers do not inherit them.  Forked processes check the settings
+    revision before using the values.
+    """
+    global _fork_hook_registered
+    import gc
+    import os
+    from django.contrib.sites.models import Site
+    from django.db import connections
+    from livesettings import conf
+
+    conf.settings._rebuild()
+
+    keys = set()
+    for group in ConfigurationSettings().groups():
+        for cfg in group._dict.values():
+            if cfg.localized:
+                for chain in cfg._localized_table().values():
+                    keys.update((group.key, key) for key in chain)
+            else:
+                keys.add((group.key, cfg.key))
+
+    if sites is None:
+        sites = [_safe_get_siteid(None)]
+    site_ids = [getattr(site, 'id', site) for site in sites]
+    for site in Site.objects.filter(id__in=site_ids):
+        use_db, overrides = get_overrides(site.id)
+        if use_db:
+            find_settings(keys, site=site)
+        log.debug('Preloaded the settings of site %s', site.id)
+    # a connection opened here would be one socket used by all workers
+    connections.close_all()
+
+    if hasattr(gc, 'freeze'):
+        # keep the collector from touching, and so copying, the shared objects
+        gc.freeze()
+    if not _fork_hook_registered and hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_after_fork)
+        _fork_hook_registered = True
@@ -0,0 +1,157 @@
+import ast
+import gzip
+import io
+import json
+import sys
+
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from livesettings.functions import ConfigurationSettings
+from livesettings.models import LongSetting, Setting, namespaces, record_changes
+
+FORMATS = ('python', 'json', 'ndjson')
+
+
+def _open(path):
+    if path == '-':
+        return sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return io.open(path, 'rt', encoding='utf-8')
+
+
+def _guess_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    for format, extension in (('ndjson', '.ndjson'), ('json', '.json'), ('python', '.py')):
+        if name.endswith(extension):
+            return format
+    return 'python'
+
+
+def _nested_rows(options):
+    """Yield (site_id, group, key, value, is_long) of {site: {'SETTINGS': {group: {key: value}}}}."""
+    for site_id, site_options in options.items():
+        for group, values in site_options.get('SETTINGS', {}).items():
+            for key, value in values.items():
+                yield int(site_id), group, key, value, None
+
+
+def read_rows(f, format):
+    """Yield (site_id, group, key, value, is_long) of an export, is_long is None if the format does not tell.
+
+    ndjson is read line by line, the python and json formats are parsed as a whole.
+    """
+    if format == 'ndjson':
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                yield row['site'], row['group'], row['key'], row['value'], row.get('long')
+    elif format == 'json':
+        for row in _nested_rows(json.load(f)):
+            yield row
+    else:
+        text = f.read()
+        start = text.find('{')
+        if start < 0:
+            raise CommandError('No LIVESETTINGS_OPTIONS dictionary found')
+        for row in _nested_rows(ast.literal_eval(text[start:])):
+            yield row
+
+
+def _is_long(group, key, value, current):
+    """Choose the table of a new or moved setting: the registered value decides, else the current table, else the length."""
+    mgr = ConfigurationSettings()
+    if mgr.has_config(group, key):
+        return isinstance(mgr.get_config(group, key).make_setting(value), LongSetting)
+    if current is not None:
+        return current[0] is LongSetting
+    return len(value) > Setting._meta.get_field('value').max_length
+
+
+class Command(BaseCommand):
+    help = ("Load a settings export (/settings/export/) into the database. Only the differences "
+            "are written, settings of the imported sites which are not in the file are deleted. "
+            "Only the ndjson format is streamed, the python and json formats are read at once.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="The exported file, '-' for stdin, *.gz is decompressed")
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Format of the file, guessed from the file name by default')
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help='Only report what would be changed')
+
+    def handle(self, path, format=None, dry_run=False, **options):
+        format = format or _guess_format(path)
+        wanted = {}
+        f = _open(path)
+        try:
+            for site_id, group, key, value, is_long in read_rows(f, format):
+                wanted.setdefault(site_id, {})[(group, key)] = (value, is_long)
+        except (ValueError, SyntaxError, KeyError) as e:
+            raise CommandError('Can not read %s: %s' % (path, e))
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+        missing = set(wanted) - set(Site.objects.filter(id__in=wanted).values_list('id', flat=True))
+        if missing:
+            raise CommandError('Unknown sites: %s' % ', '.join(str(s) for s in sorted(missing)))
+
+        changed = []
+        for site_id in sorted(wanted):
+            changed.extend(self.import_site(site_id, wanted[site_id], dry_run))
+
+        if changed and not dry_run:
+            # a new cache namespace per changed group, instead of deleting every key
+            groups = {}
+            for site_id, group, key in changed:
+                groups.setdefault(site_id, set()).add(group)
+            namespaces.bump_many(groups)
+
+    def import_site(self, site_id, wanted, dry_run):
+        """Apply the differences of one site in one transaction, return the changed (site_id, group, key)."""
+        current = {}
+        for model in (Setting, LongSetting):
+            for id, group, key, value in model._base_manager.filter(site_id=site_id).values_list(
+                    'id', 'group', 'key', 'value').iterator():
+                current[(group, key)] = (model, id, value)
+
+        inserts = {Setting: [], LongSetting: []}
+        updates = {Setting: [], LongSetting: []}
+        deletes = {Setting: [], LongSetting: []}
+        changed = []
+        for k, (value, is_long) in wanted.items():
+            found = current.pop(k, None)
+            if is_long is None:
+                is_long = _is_long(k[0], k[1], value, found)
+            model = LongSetting if is_long else Setting
+            if found is not None and found[0] is model:
+                if found[2] == value:
+                    continue
+                updates[model].append(model(id=found[1], site_id=site_id, group=k[0], key=k[1], value=value))
+            else:
+                if found is not None:
+                    deletes[found[0]].append(found[1])
+                inserts[model].append(model(site_id=site_id, group=k[0], key=k[1], value=value))
+            changed.append((site_id,) + k)
+        for k, (model, id, value) in current.items():
+            deletes[model].append(id)
+            changed.append((site_id,) + k)
+
+        counts = [sum(len(v) for v in d.values()) for d in (inserts, updates, deletes)]
+        self.stdout.write('Site %s: %s inserted, %s updated, %s deleted%s'
+                          % (site_id, counts[0], counts[1], counts[2], ' (dry run)' if dry_run else ''))
+        if dry_run or not changed:
+            return []
+
+        with transaction.atomic():
+            for model in (Setting, LongSetting):
+                if deletes[model]:
+                    model._base_manager.filter(id__in=deletes[model]).delete()
+                if updates[model]:
+                    model._base_manager.bulk_update(updates[model], ['value'], batch_size=500)
+                if inserts[model]:
+                    model._base_manager.bulk_create(inserts[model], batch_size=500)
+            record_changes(changed)
+        return changed
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from livesettings.models import setting_rows
+from livesettings.snapshot import build_options, write_snapshot
+
+
+class Command(BaseCommand):
+    help = ("Compile the settings in the database into a snapshot file, "
+            "which locks the sites down if LIVESETTINGS_SNAPSHOT_FILE points to it.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='The snapshot file to write')
+        parser.add_argument('--site', type=int, action='append', dest='sites',
+                            help='Only this site, can be repeated. All sites by default')
+
+    def handle(self, path, sites=None, **options):
+        options = build_options(setting_rows(), sites and set(sites))
+        for site_id in (sites or ()):
+            # a site without any setting is locked down with the defaults
+            options.setdefault(site_id, {'DB': False, 'SETTINGS': {}})
+        write_snapshot(path, options)
+        self.stdout.write('Wrote %s settings of %s sites to %s'
+                          % (sum(len(group) for site in options.values() for group in site['SETTINGS'].values()),
+                             len(options), path))
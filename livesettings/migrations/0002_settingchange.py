@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('sites', '0001_initial'),
+        ('livesettings', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SettingChange',
+            fields=[
+                ('id', models.BigAutoField(serialize=False, primary_key=True)),
+                ('group', models.CharField(max_length=100)),
+                ('key', models.CharField(max_length=100)),
+                ('site', models.ForeignKey(verbose_name='Site', to='sites.Site', on_delete=models.CASCADE)),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+
+import django.utils.timezone
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('livesettings', '0002_settingchange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='settingchange',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now, db_index=True),
+        ),
+    ]
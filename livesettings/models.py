@@ -1,40 +1,67 @@
+import datetime
+import hashlib
+import threading
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.sites.models import Site
-from django.db import models, connection, DatabaseError
+from django.core.signals import setting_changed
+from django.db import models, connection, transaction, DatabaseError
 
 try:
     from django.apps import apps
 except ImportError:
     from django.db.models import loading as apps
 
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from keyedcache import cache_key, cache_get, cache_set, NotCachedError
-from keyedcache.models import CachedObjectMixin
+from livesettings import broadcast, signals
+from livesettings.cache import REVISION, get_cache
 from livesettings.overrides import get_overrides
+from livesettings.snapshot import shared_snapshots
 import logging
 
 log = logging.getLogger('configuration.models')
 
-__all__ = ['SettingNotSet', 'Setting', 'LongSetting', 'find_setting']
+__all__ = ['SettingNotSet', 'Setting', 'LongSetting', 'SettingChange', 'find_setting', 'find_settings',
+           'afind_settings', 'settings_revision', 'bump_settings_revision', 'invalidate_settings',
+           'setting_cache_keys', 'record_changes', 'poll_changes', 'setting_rows']
 
+# The startup flags only ever change from True to False, by a single
+# assignment, so threads read them without a lock; at worst a thread which
+# has not seen the change yet handles one more startup error.
 try:
     is_site_initializing
 except:
     is_site_initializing = True  # until the first success find "django_site" table, by any thread
-    is_first_warn = True
+
+_warned = frozenset()
+_warn_lock = threading.Lock()
+
+
+def _warn_once(topic, message):
+    """Log the warning only the first time it is reported for the topic, by any thread."""
+    global _warned
+    if topic in _warned:
+        return
+    with _warn_lock:
+        if topic in _warned:
+            return
+        _warned = _warned | {topic}
+    log.warning(message)
 
 
 def _safe_get_siteid(site):
-    global is_site_initializing, is_first_warn
+    global is_site_initializing
     if not site:
         try:
             site = Site.objects.get_current()
             siteid = site.id
         except Exception as e:
             if is_site_initializing and isinstance(e, DatabaseError) and str(e).find('django_site') > -1:
-                if is_first_warn:
-                    log.warning(str(e).strip())
-                    is_first_warn = False
+                _warn_once('django_site', str(e).strip())
                 log.warning('Can not get siteid; probably before syncdb; ROLLBACK')
                 connection._rollback()
             else:
@@ -47,26 +74,235 @@ def _safe_get_siteid(site):
     return siteid
 
 
-def find_setting(group, key, site=None):
-    """Get a setting or longsetting by group and key, cache and return it."""
+def _app_cache_ready():
+    if hasattr(apps, 'ready'):
+        return apps.ready
+    return apps.app_cache_ready()
+
+
+def settings_revision():
+    """Return a token which changes whenever a stored setting is changed.
+
+    The token lives in the cache, so a flushed or expired cache also gives
+    a new revision.  A due poll of the change log runs first, so settings
+    changed by other nodes give a new revision too.
+    """
+    if _changes_due():
+        poll_changes()
+    return get_cache().revision()
+
+
+def bump_settings_revision():
+    """Start a new settings revision and return its token."""
+    revision = get_cache().revision(bump=True)
+    signals.settings_revision_changed.send(None, revision=revision)
+    return revision
+
+
+class Namespaces(object):
+    """Version tokens of the cache namespaces of the sites and of their groups.
+
+    The cache key of a setting is ``(site_id, group, key, site version,
+    group version, fingerprint)``, so replacing one token makes all cached
+    settings of a site or a group unreachable at once.  The tokens are kept
+    for the settings revision they were read in, which is read along with
+    the settings on every lookup, so a new revision started by another
+    process is seen too.
+
+    The fingerprint identifies the definition of the registered value, so a
+    value whose type changed in a deploy does not read the entries cached
+    by the old code, while the other entries stay valid.
+    """
+
+    def __init__(self):
+        # (revision, {name: token}), replaced as a whole
+        self.memo = (None, {})
+        # {(group, key): fingerprint} of the registered values, replaced as a whole
+        self.fingerprints = {}
+
+    def mark_stale(self, **kwargs):
+        self.memo = (None, {})
+
+    def _tokens(self, revision, found):
+        memo = self.memo
+        if memo[0] != revision:
+            memo = self.memo = (revision, {})
+        memo[1].update(found)
+        return memo[1]
+
+    def _missing(self, tokens, siteid, groups):
+        wanted = [('ns', siteid)] + [('ns', siteid, group) for group in groups]
+        return [k for k in wanted if k not in tokens]
+
+    def keys(self, siteid, pairs):
+        """Return {(group, key): cache key} of the (group, key) pairs of the site.
+
+        The revision and the unknown tokens are read in one round trip, the
+        tokens are read again only if the revision changed.
+        """
+        cache = get_cache()
+        groups = set(group for group, key in pairs)
+        found = cache.get_many([REVISION] + self._missing(self.memo[1], siteid, groups))
+        tokens = self._tokens(found.pop(REVISION, None) or cache.revision(), found)
+        missing = self._missing(tokens, siteid, groups)
+        if missing:
+            found = cache.get_many(missing)
+            for k in missing:
+                # a new random token never revives entries of an expired one
+                tokens[k] = found[k] if k in found else cache.add(k, uuid.uuid4().hex[:8])
+        return self._keys(tokens, siteid, pairs)
+
+    async def akeys(self, siteid, pairs):
+        """Async `keys`."""
+        cache = get_cache()
+        groups = set(group for group, key in pairs)
+        found = await cache.aget_many([REVISION] + self._missing(self.memo[1], siteid, groups))
+        tokens = self._tokens(found.pop(REVISION, None) or await cache.arevision(), found)
+        missing = self._missing(tokens, siteid, groups)
+        if missing:
+            found = await cache.aget_many(missing)
+            for k in missing:
+                tokens[k] = found[k] if k in found else await cache.aadd(k, uuid.uuid4().hex[:8])
+        return self._keys(tokens, siteid, pairs)
+
+    def cached(self, siteid, pairs):
+        """Return the cache keys of the (group, key) pairs of the site and their cached entries.
+
+        With the tokens known, the revision is read along with the entries,
+        so a lookup is one round trip unless the revision changed.
+        """
+        cache = get_cache()
+        revision, tokens = self.memo
+        if revision is not None and not self._missing(tokens, siteid, set(group for group, key in pairs)):
+            cks = self._keys(tokens, siteid, pairs)
+            entries = cache.get_many([REVISION] + list(cks.values()))
+            if entries.pop(REVISION, None) == revision:
+                return cks, entries
+        cks = self.keys(siteid, pairs)
+        return cks, cache.get_many(list(cks.values()))
+
+    async def acached(self, siteid, pairs):
+        """Async `cached`."""
+        cache = get_cache()
+        revision, tokens = self.memo
+        if revision is not None and not self._missing(tokens, siteid, set(group for group, key in pairs)):
+            cks = self._keys(tokens, siteid, pairs)
+            entries = await cache.aget_many([REVISION] + list(cks.values()))
+            if entries.pop(REVISION, None) == revision:
+                return cks, entries
+        cks = await self.akeys(siteid, pairs)
+        return cks, await cache.aget_many(list(cks.values()))
+
+    def _keys(self, memo, siteid, pairs):
+        site = memo[('ns', siteid)]
+        cks = {}
+        for group, key in pairs:
+            cks[(group, key)] = (siteid, group, key, site, memo[('ns', siteid, group)], self.fingerprint(group, key))
+        return cks
+
+    def define(self, value):
+        """Record the fingerprint of a registered `Value`."""
+        cls = type(value)
+        definition = '%s:%s:%s.%s' % (value.group.key, value.key, cls.__module__, cls.__qualname__)
+        fingerprints = dict(self.fingerprints)
+        fingerprints[(value.group.key, value.key)] = hashlib.md5(definition.encode('utf-8')).hexdigest()[:8]
+        self.fingerprints = fingerprints
+
+    def fingerprint(self, group, key):
+        """Return the fingerprint of the value stored as group and key, '' if it is not registered."""
+        fingerprints = self.fingerprints
+        try:
+            return fingerprints[(group, key)]
+        except KeyError:
+            pass
+        # the storage keys of localized values end with the language, e.g. KEY_PT_BR
+        base = key
+        for i in range(2):
+            base = base.rpartition('_')[0]
+            if not base:
+                break
+            if (group, base) in fingerprints:
+                return fingerprints[(group, base)]
+        return ''
+
+    def key(self, siteid, group, key):
+        return self.keys(siteid, [(group, key)])[(group, key)]
+
+    def bump(self, siteid, groups=None):
+        """Invalidate the cached settings of the site, or of some of its groups."""
+        self.bump_many({siteid: groups})
+
+    def bump_many(self, sites):
+        """Invalidate the cached settings of {siteid: groups or None for all} with one new revision."""
+        names = []
+        for siteid, groups in sites.items():
+            if groups is None:
+                names.append(('ns', siteid))
+            else:
+                names.extend(('ns', siteid, group) for group in groups)
+        get_cache().set_many(dict((k, uuid.uuid4().hex[:8]) for k in names))
+        bump_settings_revision()
+        shared_snapshots.bump()
+
+
+namespaces = Namespaces()
+setting_changed.connect(namespaces.mark_stale)
+signals.settings_revision_changed.connect(namespaces.mark_stale)
+
+
+def invalidate_settings(site=None, groups=None):
+    """Drop the cached settings of a site, or of some of its groups, in constant time per group."""
+    namespaces.bump(_safe_get_siteid(site), groups)
+
+
+_FIELDS = ('id', 'site_id', 'group', 'key', 'value')
+
+
+def _pack(setting):
+    """Return the cache entry of a stored setting: (id, value, is_long), or None."""
+    if not setting:
+        return None
+    return (setting.id, setting.value, isinstance(setting, LongSetting))
+
+
+def _unpack(ck, entry):
+    """Return the Setting or LongSetting of the cache key (site_id, group, key) and its entry."""
+    if not isinstance(entry, tuple):
+        # None, or a model instance cached by an earlier version
+        return entry
+    id, value, is_long = entry
+    model = LongSetting if is_long else Setting
+    return model.from_db(None, _FIELDS, (id,) + tuple(ck[:3]) + (value,))
+
+
+def find_setting(group, key, site=None, shared=True):
+    """Get a setting or longsetting by group and key, cache and return it.
+
+    With shared=False the shared snapshot is not used, which is needed for
+    a setting which is going to be saved.
+    """
 
     siteid = _safe_get_siteid(site)
     setting = None
 
     use_db, overrides = get_overrides(siteid)
-    ck = cache_key('Setting', siteid, group, key)
+    if use_db and _changes_due():
+        poll_changes()
+    ck = (siteid, group, key)
 
-    if use_db:
-        try:
-            setting = cache_get(ck)
+    snapshot = use_db and shared and shared_snapshots.get(siteid)
+    if snapshot:
+        setting = snapshot.get(group, key)
 
-        except NotCachedError as nce:
-            if hasattr(apps, 'ready'):
-                app_cache_ready = apps.ready
-            else:
-                app_cache_ready = apps.app_cache_ready()
+    elif use_db:
+        # a cached None is a setting known not to exist
+        cks, cached = namespaces.cached(siteid, [(group, key)])
+        ck = cks[(group, key)]
+        if ck in cached:
+            setting = _unpack(ck, cached[ck])
 
-            if app_cache_ready:
+        else:
+            if _app_cache_ready():
                 try:
                     setting = Setting.objects.get(site__id__exact=siteid, key__exact=key, group__exact=group)
 
@@ -78,7 +314,7 @@ def find_setting(group, key, site=None):
                     except LongSetting.DoesNotExist:
                         pass
 
-                cache_set(ck, value=setting)
+                get_cache().set_many({ck: _pack(setting)})
 
     else:
         grp = overrides.get(group, None)
@@ -93,6 +329,142 @@ def find_setting(group, key, site=None):
     return setting
 
 
+def _override_settings(keys, overrides):
+    found = {}
+    for group, key in keys:
+        grp = overrides.get(group, None)
+        if grp and key in grp:
+            found[(group, key)] = ImmutableSetting(key=key, group=group, value=grp[key])
+    return found
+
+
+def _snapshot_settings(keys, snapshot):
+    found = {}
+    for group, key in keys:
+        setting = snapshot.get(group, key)
+        if setting is not None:
+            found[(group, key)] = setting
+    return found
+
+
+def _split_cached(cks, cached, found):
+    """Add the cached settings of cks = {(group, key): cache key} to found, return the others."""
+    missing = {}
+    for (group, key), ck in cks.items():
+        if ck in cached:
+            if cached[ck]:
+                found[(group, key)] = _unpack(ck, cached[ck])
+        else:
+            missing[(group, key)] = ck
+    return missing
+
+
+def _missing_query(model, missing, loaded, siteid):
+    """Return the query of the missing settings not loaded yet from the other table, or None."""
+    pending = [k for k in missing if k not in loaded]
+    if not pending:
+        return None
+    return model.objects.filter(site__id__exact=siteid,
+                                group__in=set(g for g, _k in pending),
+                                key__in=set(_k for g, _k in pending))
+
+
+def _add_loaded(settings, missing, loaded):
+    for setting in settings:
+        k = (setting.group, setting.key)
+        if k in missing and k not in loaded:
+            loaded[k] = setting
+
+
+def _store_loaded(missing, loaded, found):
+    """Add the loaded settings to found, return the cache entries of all missing keys."""
+    entries = {}
+    for k, ck in missing.items():
+        setting = loaded.get(k)
+        entries[ck] = _pack(setting)
+        if setting:
+            found[k] = setting
+    return entries
+
+
+def find_settings(keys, site=None):
+    """Get settings or longsettings for several (group, key) pairs at once.
+
+    The cache is read with one round trip, the pairs missing from it are
+    loaded with one query per table and cached.  Returns a dict of
+    (group, key) -> setting, which leaves out the pairs without a setting.
+    """
+    siteid = _safe_get_siteid(site)
+
+    use_db, overrides = get_overrides(siteid)
+    if not use_db:
+        return _override_settings(keys, overrides)
+    if _changes_due():
+        poll_changes()
+
+    snapshot = shared_snapshots.get(siteid)
+    if snapshot:
+        return _snapshot_settings(keys, snapshot)
+
+    found = {}
+    keys = list(keys)
+    cks, cached = namespaces.cached(siteid, keys)
+    missing = _split_cached(cks, cached, found)
+    if missing and _app_cache_ready():
+        loaded = {}
+        for model in (Setting, LongSetting):
+            qs = _missing_query(model, missing, loaded, siteid)
+            if qs is not None:
+                _add_loaded(qs, missing, loaded)
+        get_cache().set_many(_store_loaded(missing, loaded, found))
+
+    return found
+
+
+async def _asafe_get_siteid(site):
+    if site:
+        return site.id
+    siteid = getattr(settings, 'SITE_ID', None)
+    if siteid is not None:
+        return siteid
+    return await sync_to_async(_safe_get_siteid)(site)
+
+
+async def _alist(qs):
+    if hasattr(qs, '__aiter__'):
+        return [obj async for obj in qs]
+    return await sync_to_async(list)(qs)
+
+
+async def afind_settings(keys, site=None):
+    """Async `find_settings`, with the async cache and ORM APIs where Django has them."""
+    siteid = await _asafe_get_siteid(site)
+
+    use_db, overrides = get_overrides(siteid)
+    if not use_db:
+        return _override_settings(keys, overrides)
+    if _changes_due():
+        await sync_to_async(poll_changes)()
+
+    snapshot = await shared_snapshots.aget(siteid)
+    if snapshot:
+        return _snapshot_settings(keys, snapshot)
+
+    found = {}
+    keys = list(keys)
+    cks, cached = await namespaces.acached(siteid, keys)
+    missing = _split_cached(cks, cached, found)
+    if missing and _app_cache_ready():
+        loaded = {}
+        for model in (Setting, LongSetting):
+            qs = _missing_query(model, missing, loaded, siteid)
+            if qs is not None:
+                _add_loaded(await _alist(qs), missing, loaded)
+        await get_cache().aset_many(_store_loaded(missing, loaded, found))
+
+    return found
+
+
 class SettingNotSet(Exception):
     def __init__(self, k, cachekey=None):
         self.key = k
@@ -122,7 +494,7 @@ class ImmutableSetting(object):
         self.value = value
 
     def cache_key(self, *args, **kwargs):
-        return cache_key('OverrideSetting', self.site, self.group, self.key)
+        return (self.site, self.group, self.key)
 
     def delete(self):
         pass
@@ -134,7 +506,41 @@ class ImmutableSetting(object):
         return "ImmutableSetting: %s.%s=%s" % (self.group, self.key, self.value)
 
 
-class Setting(models.Model, CachedObjectMixin):
+class CachedSettingMixin(object):
+    """Keeps a stored setting in the settings cache.
+
+    Setting and LongSetting share the cache keys, so both are found with one
+    lookup.  They can't overlap anyway; at the worst, the Setting will
+    override a LongSetting.
+    """
+
+    def cache_key(self, *args, **kwargs):
+        return namespaces.key(self.site_id, self.group, self.key)
+
+    def cache_set(self, *args, **kwargs):
+        get_cache().set_many({self.cache_key(): _pack(self)})
+
+    def cache_delete(self, *args, **kwargs):
+        get_cache().delete_many([self.cache_key()])
+
+
+def _setting_changed(setting):
+    """Start a new settings revision for this process now, and for the others once the change is committed."""
+    record_changes([(setting.site_id, setting.group, setting.key)])
+    if transaction.get_connection().in_atomic_block:
+        # this process reads its own change before the commit
+        bump_settings_revision()
+        shared_snapshots.suspend()
+    transaction.on_commit(_settings_committed)
+
+
+def _settings_committed():
+    # again after the commit, so nothing read before it is kept for the new revision
+    bump_settings_revision()
+    shared_snapshots.bump()
+
+
+class Setting(CachedSettingMixin, models.Model):
     site = models.ForeignKey(Site, verbose_name=_('Site'), on_delete=models.CASCADE)
     group = models.CharField(max_length=100, blank=False, null=False)
     key = models.CharField(max_length=100, blank=False, null=False)
@@ -148,12 +554,10 @@ class Setting(models.Model, CachedObjectMixin):
     def __str__(self):
         return f'{self.group}.{self.key} = {self.value}'
 
-    def cache_key(self, *args, **kwargs):
-        return cache_key('Setting', self.site, self.group, self.key)
-
     def delete(self, using=None, keep_parents=False):
         self.cache_delete()
         super(Setting, self).delete()
+        _setting_changed(self)
 
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
@@ -165,6 +569,7 @@ class Setting(models.Model, CachedObjectMixin):
         super(Setting, self).save(force_insert=force_insert, force_update=force_update)
 
         self.cache_set()
+        _setting_changed(self)
 
     class Meta:
         unique_together = ('site', 'group', 'key')
@@ -185,7 +590,7 @@ class LongSettingManager(models.Manager):
         return all.filter(site__id__exact=siteid)
 
 
-class LongSetting(models.Model, CachedObjectMixin):
+class LongSetting(CachedSettingMixin, models.Model):
     """A Setting which can handle more than 255 characters"""
     site = models.ForeignKey(Site, verbose_name=_('Site'), on_delete=models.CASCADE)
     group = models.CharField(max_length=100, blank=False, null=False)
@@ -200,15 +605,10 @@ class LongSetting(models.Model, CachedObjectMixin):
     def __str__(self):
         return f'{self.group}.{self.key} = {self.value}'
 
-    def cache_key(self, *args, **kwargs):
-        # note same cache pattern as Setting.  This is so we can look up in one check.
-        # they can't overlap anyway, so this is moderately safe.  At the worst, the
-        # Setting will override a LongSetting.
-        return cache_key('Setting', self.site, self.group, self.key)
-
     def delete(self, using=None, keep_parents=False):
         self.cache_delete()
         super(LongSetting, self).delete()
+        _setting_changed(self)
 
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
@@ -218,7 +618,152 @@ class LongSetting(models.Model, CachedObjectMixin):
             self.site = Site.objects.get_current()
         super(LongSetting, self).save(force_insert=force_insert, force_update=force_update)
         self.cache_set()
+        _setting_changed(self)
 
     class Meta:
         unique_together = ('site', 'group', 'key')
         app_label = 'livesettings'
+
+
+class SettingChange(models.Model):
+    """One changed setting, so processes with their own cache can reload it.
+
+    Written only if LIVESETTINGS_CHANGE_POLL_INTERVAL is set, see `poll_changes`.
+    Rows older than LIVESETTINGS_CHANGE_RETENTION seconds are deleted when
+    changes are written.
+    """
+    id = models.BigAutoField(primary_key=True)
+    site = models.ForeignKey(Site, verbose_name=_('Site'), on_delete=models.CASCADE)
+    group = models.CharField(max_length=100)
+    key = models.CharField(max_length=100)
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f'{self.id}: {self.group}.{self.key}'
+
+    class Meta:
+        app_label = 'livesettings'
+
+
+def _poll_interval():
+    return getattr(settings, 'LIVESETTINGS_CHANGE_POLL_INTERVAL', None)
+
+
+def _retention():
+    return getattr(settings, 'LIVESETTINGS_CHANGE_RETENTION', 86400)
+
+
+def record_changes(changes):
+    """Tell the other processes about the changed (site_id, group, key).
+
+    The changes are logged for `poll_changes`, and sent to the processes of
+    this host by `broadcast.publish` once the transaction is committed.
+    Logged changes older than LIVESETTINGS_CHANGE_RETENTION are deleted.
+    """
+    if not changes:
+        return
+    if _poll_interval() is not None:
+        SettingChange.objects.filter(
+            created__lt=timezone.now() - datetime.timedelta(seconds=_retention())).delete()
+        SettingChange.objects.bulk_create([SettingChange(site_id=site_id, group=group, key=key)
+                                           for site_id, group, key in changes], batch_size=500)
+    if broadcast._directory():
+        transaction.on_commit(lambda: broadcast.publish(changes))
+
+
+def setting_cache_keys(changes):
+    """Return {(site_id, group, key): cache key} of the (site_id, group, key)."""
+    by_site = {}
+    for site_id, group, key in changes:
+        by_site.setdefault(site_id, []).append((group, key))
+    cks = {}
+    for site_id, pairs in by_site.items():
+        for (group, key), ck in namespaces.keys(site_id, pairs).items():
+            cks[(site_id, group, key)] = ck
+    return cks
+
+
+def _reload_settings(changed):
+    """Cache the current settings, or their absence, of the (site_id, group, key)."""
+    cks = setting_cache_keys(changed)
+    entries = dict.fromkeys(cks.values())
+    for model in (LongSetting, Setting):
+        # Setting last, it wins over a LongSetting like in find_setting
+        qs = model._base_manager.filter(group__in=set(c[1] for c in changed), key__in=set(c[2] for c in changed),
+                                        site_id__in=set(c[0] for c in changed))
+        for setting in qs:
+            k = (setting.site_id, setting.group, setting.key)
+            if k in cks:
+                entries[cks[k]] = _pack(setting)
+    get_cache().set_many(entries)
+
+
+# (monotonic time of the next poll, id of the last seen change), replaced as a whole
+_changes = (0, None)
+
+
+def _changes_due():
+    interval = _poll_interval()
+    return interval is not None and time.monotonic() >= _changes[0]
+
+
+def poll_changes(force=False):
+    """Reload the settings changed by other processes into the cache, return their (site_id, group, key).
+
+    The change log is checked at most every LIVESETTINGS_CHANGE_POLL_INTERVAL
+    seconds, with a query of its first and last id.  Only if it grew the
+    changed settings are read and cached, and a new settings revision is
+    started.  If changes this process did not see yet were already deleted
+    from the log, all cached settings of this process are dropped instead.
+    A change committed after a later one can be missed; it is seen when its
+    cache entry expires.
+    """
+    global _changes
+    if not (force or _changes_due()) or not _app_cache_ready():
+        return []
+    next_poll, last_id = time.monotonic() + (_poll_interval() or 0), _changes[1]
+    _changes = (next_poll, last_id)
+    try:
+        ids = SettingChange.objects.aggregate(oldest=models.Min('id'), latest=models.Max('id'))
+        latest = ids['latest'] or 0
+        if last_id is None or latest == last_id:
+            # nothing to reload in the first poll, the cache of this process is new
+            _changes = (next_poll, latest)
+            return []
+        if ids['oldest'] is not None and ids['oldest'] > last_id + 1:
+            # the log was pruned past the last change this process saw
+            _changes = (next_poll, latest)
+            log.info('Missed settings changes, dropping all cached settings of this process')
+            namespaces.bump_many(dict.fromkeys(Site.objects.values_list('id', flat=True)))
+            shared_snapshots.bump(change_id=latest)
+            return []
+        changed = set(SettingChange.objects.filter(id__gt=last_id, id__lte=latest)
+                      .values_list('site_id', 'group', 'key'))
+        _reload_settings(changed)
+    except DatabaseError as e:
+        _warn_once('livesettings_settingchange', 'Can not poll the settings changes: %s' % e)
+        return []
+
+    _changes = (next_poll, latest)
+    log.debug('Reloaded %s settings changed by other processes', len(changed))
+    bump_settings_revision()
+    shared_snapshots.bump(change_id=latest)
+    return sorted(changed)
+
+
+def setting_rows():
+    """Yield (site_id, group, key, value, is_long) of all sites, ordered by site, group and key.
+
+    Both tables are read by one query, so the order is the order of the database.
+    A key stored in both tables is yielded once, with the Setting, which wins
+    like in find_setting.
+    """
+    fields = ('site_id', 'group', 'key', 'value', 'is_long')
+    short = Setting._base_manager.annotate(is_long=models.Value(False, output_field=models.BooleanField()))
+    long = LongSetting._base_manager.annotate(is_long=models.Value(True, output_field=models.BooleanField()))
+    qs = short.values_list(*fields).union(long.values_list(*fields), all=True)
+    last = None
+    for row in qs.order_by('site_id', 'group', 'key', 'is_long').iterator(chunk_size=2000):
+        if row[:3] != last:
+            last = row[:3]
+            yield row
@@ -43,16 +43,35 @@ def get_overrides(siteid=-1):
     The easiest way to get a right formated expression is by the URL
     http://your.site/settings/export/
 
+    The same dictionary can be compiled into a file by the livesettings_snapshot
+    command and loaded from LIVESETTINGS_SNAPSHOT_FILE, on the first call.
+    Sites in LIVESETTINGS_OPTIONS take precedence over the snapshot.
+
     Returns a tuple (DB_ALLOWED, SETTINGS)
     """
     overrides = (True, {})
-    if hasattr(djangosettings, 'LIVESETTINGS_OPTIONS'):
+    snapshot_file = getattr(djangosettings, 'LIVESETTINGS_SNAPSHOT_FILE', None)
+    if hasattr(djangosettings, 'LIVESETTINGS_OPTIONS') or snapshot_file:
         if siteid == -1:
             siteid = _safe_get_siteid(None)
 
-        opts = djangosettings.LIVESETTINGS_OPTIONS
+        opts = getattr(djangosettings, 'LIVESETTINGS_OPTIONS', {})
+        if siteid not in opts and snapshot_file:
+            opts = _snapshot_options(snapshot_file)
         if siteid in opts:
             opts = opts[siteid]
             overrides = (opts.get('DB', True), opts['SETTINGS'])
 
     return overrides
+
+
+_snapshot = (None, {})
+
+
+def _snapshot_options(path):
+    """Return the options of the snapshot file, loaded once per path."""
+    global _snapshot
+    if _snapshot[0] != path:
+        from livesettings.snapshot import load_snapshot
+        _snapshot = (path, load_snapshot(path))
+    return _snapshot[1]
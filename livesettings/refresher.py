@@ -0,0 +1,111 @@
+"""Keep the settings of a long running process up to date without a request cycle.
+
+    from livesettings import refresher
+    refresher.start()
+
+starts a daemon thread which checks the settings revision every
+LIVESETTINGS_REFRESH_INTERVAL seconds (default 10).  When it changed, the
+values of all registered non-localized settings are loaded into a new
+snapshot, which replaces the old one by a single assignment and is
+installed into `livesettings.conf`, so reading ``conf.GROUP.KEY`` in a hot
+loop needs no I/O.  `configuration_value_changed` is sent for every value
+which changed, with ``refreshed=True``.
+"""
+import logging
+import threading
+import types
+
+from django.conf import settings as djangosettings
+from django.db import close_old_connections
+from livesettings import conf, signals
+from livesettings.functions import ConfigurationSettings
+from livesettings.models import settings_revision, _safe_get_siteid
+from livesettings.values import NOTSET, SortedDotDict, load_raw_values
+
+__all__ = ['Refresher', 'start', 'stop']
+
+log = logging.getLogger('configuration.refresher')
+
+
+class Refresher(threading.Thread):
+    """Daemon thread which polls the settings revision and swaps in new snapshots."""
+
+    def __init__(self, interval=None):
+        super(Refresher, self).__init__(name='livesettings-refresher', daemon=True)
+        if interval is None:
+            interval = getattr(djangosettings, 'LIVESETTINGS_REFRESH_INTERVAL', 10)
+        self.interval = interval
+        self.state = None
+        # read-only {(group, key): value}, replaced as a whole
+        self.values = types.MappingProxyType({})
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            close_old_connections()
+            try:
+                self.refresh()
+            except Exception:
+                log.exception('Could not refresh the settings')
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self._stopped.set()
+
+    def refresh(self):
+        """Load a new snapshot if the settings changed, return the (group, key) of the changed values."""
+        mgr = ConfigurationSettings()
+        state = (settings_revision(), mgr.generation, _safe_get_siteid(None))
+        if state == self.state:
+            return []
+
+        cfgs = [cfg for group in mgr.groups() for cfg in SortedDotDict.values(group) if not cfg.localized]
+        raw = load_raw_values(cfgs)
+        values = {}
+        for cfg in cfgs:
+            k = (cfg.group.key, cfg.key)
+            try:
+                values[k] = cfg.to_python(raw[k])
+            except Exception as e:
+                # left to fail where it is read
+                log.debug('Could not refresh %s.%s: %s', k[0], k[1], e)
+
+        old, first = self.values, self.state is None
+        self.values = types.MappingProxyType(values)
+        self.state = state
+        conf.resolver.install(state, values)
+        log.debug('Refreshed the settings for revision %s', state[0])
+
+        if first:
+            return []
+        changed = [k for k, value in values.items() if old.get(k, NOTSET) != value]
+        for k in changed:
+            cfg = mgr.get_config(*k)
+            signals.configuration_value_changed.send(cfg.__class__, old_value=old.get(k), new_value=values[k],
+                                                     setting=cfg, refreshed=True)
+        return changed
+
+
+_refresher = None
+_lock = threading.Lock()
+
+
+def start(interval=None):
+    """Start the refresher thread of this process, unless it is running, and return it."""
+    global _refresher
+    with _lock:
+        if _refresher is None or not _refresher.is_alive():
+            _refresher = Refresher(interval)
+            _refresher.refresh()
+            _refresher.start()
+        return _refresher
+
+
+def stop():
+    """Stop the refresher thread of this process."""
+    global _refresher
+    with _lock:
+        if _refresher is not None:
+            _refresher.stop()
+            _refresher = None
@@ -1,3 +1,6 @@
 import django.dispatch
 
 configuration_value_changed = django.dispatch.Signal()
+
+# sent by this process whenever it starts a new settings revision
+settings_revision_changed = django.dispatch.Signal()
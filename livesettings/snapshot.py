@@ -0,0 +1,322 @@
+"""Compiled settings snapshots, for starting locked down sites without the database.
+
+A snapshot file holds the same dictionary as LIVESETTINGS_OPTIONS::
+
+    {siteid: {'DB': False, 'SETTINGS': {group: {key: value}}}}
+
+after a header with the format and marshal versions.  It is written by the
+``livesettings_snapshot`` command and used by `get_overrides` if the
+LIVESETTINGS_SNAPSHOT_FILE setting points to it.
+
+Shared snapshots are the settings of one site and one host revision, in
+files under LIVESETTINGS_SHARED_SNAPSHOT_DIR.  The host revision is kept in
+the ``revision`` file of that directory, so the processes of the host agree
+on it even if each one has its own cache.  It is replaced after a change of
+the settings is committed, or when a poll of the change log finds changes
+which are new to the host.  The first process which sees a new host revision
+writes the file of its site, the other processes of the host map the same
+file and decode the entries they read.
+"""
+import logging
+import marshal
+import mmap
+import os
+import struct
+import tempfile
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from asgiref.sync import sync_to_async
+from django.conf import settings as djangosettings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import request_started, setting_changed
+from django.db import DatabaseError
+from livesettings import signals
+
+__all__ = ['build_options', 'write_snapshot', 'load_snapshot', 'SharedSnapshot', 'shared_snapshots']
+
+log = logging.getLogger('configuration.snapshot')
+
+MAGIC = b'LSNP'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('>4sHH')
+
+
+def build_options(rows, sites=None):
+    """Return the LIVESETTINGS_OPTIONS dictionary of (site_id, group, key, value, ...) rows."""
+    options = {}
+    for row in rows:
+        site_id, group, key, value = row[:4]
+        if sites is not None and site_id not in sites:
+            continue
+        site = options.setdefault(site_id, {'DB': False, 'SETTINGS': {}})
+        site['SETTINGS'].setdefault(group, {})[key] = value
+    return options
+
+
+def _write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.livesettings')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except:
+        os.remove(tmp)
+        raise
+
+
+def write_snapshot(path, options):
+    """Write the options to path, atomically replacing an older snapshot."""
+    _write_atomic(path, HEADER.pack(MAGIC, FORMAT_VERSION, marshal.version) + marshal.dumps(options, marshal.version))
+
+
+def load_snapshot(path):
+    """Return the options stored in a snapshot file.
+
+    The whole file is read and decoded at once, which marshal does faster
+    than the settings could be looked up one by one.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        raise ImproperlyConfigured('Can not load the settings snapshot %s: %s' % (path, e))
+    if len(data) < HEADER.size:
+        raise ImproperlyConfigured('%s is not a livesettings snapshot' % path)
+    magic, version, marshal_version = HEADER.unpack(data[:HEADER.size])
+    if magic != MAGIC:
+        raise ImproperlyConfigured('%s is not a livesettings snapshot' % path)
+    if (version, marshal_version) != (FORMAT_VERSION, marshal.version):
+        raise ImproperlyConfigured('%s was compiled by another version, run livesettings_snapshot again' % path)
+    try:
+        return marshal.loads(memoryview(data)[HEADER.size:])
+    except (ValueError, EOFError, TypeError) as e:
+        raise ImproperlyConfigured('Can not load the settings snapshot %s: %s' % (path, e))
+
+
+SHARED_MAGIC = b'LSHS'
+# magic, format version, marshal version, settings revision, length of the index
+SHARED_HEADER = struct.Struct('>4sHH32sI')
+
+
+class SharedSnapshot(object):
+    """The settings of one site at one revision, in a read-only memory map.
+
+    The index {(group, key): (offset, length, id, is_long)} is decoded when
+    the file is mapped, the values only when they are read.
+    """
+
+    def __init__(self, siteid, revision, data, index, offset):
+        self.siteid = siteid
+        self.revision = revision
+        self.data = data
+        self.index = index
+        self.offset = offset
+        self.settings = {}
+
+    def get(self, group, key):
+        """Return the Setting or LongSetting of group and key, None if there is none."""
+        k = (group, key)
+        try:
+            return self.settings[k]
+        except KeyError:
+            pass
+        try:
+            offset, length, id, is_long = self.index[k]
+        except KeyError:
+            return None
+
+        from livesettings.models import LongSetting, Setting
+        start = self.offset + offset
+        value = self.data[start:start + length].decode('utf-8')
+        model = LongSetting if is_long else Setting
+        setting = self.settings[k] = model(id=id, site_id=self.siteid, group=group, key=key, value=value)
+        return setting
+
+    @classmethod
+    def open(cls, path, siteid, revision):
+        """Map the file if it holds the revision, else return None."""
+        try:
+            with open(path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(data) >= SHARED_HEADER.size:
+            magic, version, marshal_version, file_revision, index_length = SHARED_HEADER.unpack(
+                data[:SHARED_HEADER.size])
+            if (magic, version, marshal_version, file_revision) == (
+                    SHARED_MAGIC, FORMAT_VERSION, marshal.version, revision.encode('ascii')):
+                offset = SHARED_HEADER.size + index_length
+                index = marshal.loads(data[SHARED_HEADER.size:offset])
+                return cls(siteid, revision, data, index, offset)
+        data.close()
+        return None
+
+    @staticmethod
+    def write(path, siteid, revision):
+        """Write the settings of the site from the database, labeled with the revision."""
+        from livesettings.models import LongSetting, Setting
+
+        index = {}
+        values = []
+        offset = 0
+        for model, is_long in ((Setting, False), (LongSetting, True)):
+            qs = model._base_manager.filter(site_id=siteid).values_list('id', 'group', 'key', 'value')
+            for id, group, key, value in qs.iterator():
+                if (group, key) in index:
+                    # a Setting wins over a LongSetting like in find_setting
+                    continue
+                value = value.encode('utf-8')
+                index[(group, key)] = (offset, len(value), id, is_long)
+                values.append(value)
+                offset += len(value)
+
+        index = marshal.dumps(index, marshal.version)
+        header = SHARED_HEADER.pack(SHARED_MAGIC, FORMAT_VERSION, marshal.version, revision.encode('ascii'),
+                                    len(index))
+        _write_atomic(path, b''.join([header, index] + values))
+        log.debug('Wrote the shared settings snapshot %s for revision %s', path, revision)
+
+
+REVISION_FILE = 'revision'
+
+
+def _read_host_revision(directory):
+    """Return (id of the last change seen by the host, token) of the shared snapshots, creating it."""
+    try:
+        with open(os.path.join(directory, REVISION_FILE), 'rb') as f:
+            change_id, token = f.read().decode('ascii').split()
+        return int(change_id), token
+    except (OSError, ValueError):
+        return _write_host_revision(directory, 0)
+
+
+def _write_host_revision(directory, change_id):
+    token = uuid.uuid4().hex
+    _write_atomic(os.path.join(directory, REVISION_FILE), ('%d %s' % (change_id, token)).encode('ascii'))
+    return change_id, token
+
+
+class SharedSnapshots(object):
+    """The shared snapshots of the sites used by this process, for the current host revision.
+
+    The host revision is checked once per request and when this process
+    changes a setting.  If the snapshot can not be used, e.g. because another
+    process is writing it, the site is read the usual way until the next
+    check.  After this process changed a setting it does not use the
+    snapshots until the host revision changes, i.e. until the change is
+    committed.
+    """
+
+    def __init__(self):
+        # (host revision, {siteid: SharedSnapshot or None}), replaced as a whole
+        self.memo = (None, {})
+        self.stale = True
+        self.suspended = None
+
+    @property
+    def revision(self):
+        return self.memo[0]
+
+    @property
+    def sites(self):
+        return self.memo[1]
+
+    def mark_stale(self, **kwargs):
+        self.stale = True
+
+    def suspend(self):
+        """Read the settings the usual way until the host revision changes."""
+        directory = getattr(djangosettings, 'LIVESETTINGS_SHARED_SNAPSHOT_DIR', None)
+        if directory:
+            self.suspended = _read_host_revision(directory)[1]
+            self.stale = True
+
+    def bump(self, change_id=None):
+        """Start a new host revision after committed changes.
+
+        With change_id, the id of the last change read from the change log,
+        only if the host has not seen it yet.
+        """
+        directory = getattr(djangosettings, 'LIVESETTINGS_SHARED_SNAPSHOT_DIR', None)
+        if not directory:
+            return
+        current_id, token = _read_host_revision(directory)
+        if change_id is None:
+            change_id = current_id
+        elif change_id <= current_id:
+            return
+        _write_host_revision(directory, change_id)
+        self.stale = True
+
+    def get(self, siteid):
+        """Return the SharedSnapshot of the site, or None."""
+        directory = getattr(djangosettings, 'LIVESETTINGS_SHARED_SNAPSHOT_DIR', None)
+        if not directory:
+            return None
+
+        if self.stale:
+            self.stale = False
+            revision = _read_host_revision(directory)[1]
+            old_revision, sites = self.memo
+            if revision != old_revision:
+                self.memo = (revision, {})
+            else:
+                self.memo = (revision, dict((k, v) for k, v in sites.items() if v is not None))
+
+        revision, sites = self.memo
+        if revision == self.suspended:
+            return None
+        try:
+            return sites[siteid]
+        except KeyError:
+            snapshot = sites[siteid] = self.open(directory, siteid, revision)
+            return snapshot
+
+    async def aget(self, siteid):
+        """Async `get`, the revision check and opening the file run in a thread."""
+        if not getattr(djangosettings, 'LIVESETTINGS_SHARED_SNAPSHOT_DIR', None):
+            return None
+        revision, sites = self.memo
+        if self.stale or siteid not in sites:
+            return await sync_to_async(self.get)(siteid)
+        if revision == self.suspended:
+            return None
+        return sites[siteid]
+
+    def open(self, directory, siteid, revision):
+        path = os.path.join(directory, 'site-%s.snapshot' % siteid)
+        snapshot = SharedSnapshot.open(path, siteid, revision)
+        if snapshot is not None:
+            return snapshot
+
+        lock = open(os.path.join(directory, 'site-%s.lock' % siteid), 'a')
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # another process is writing it
+                    return None
+            # it could have been written while we were waiting
+            snapshot = SharedSnapshot.open(path, siteid, revision)
+            if snapshot is None:
+                try:
+                    SharedSnapshot.write(path, siteid, revision)
+                except DatabaseError as e:
+                    log.warning('Can not write the shared settings snapshot %s: %s', path, e)
+                    return None
+                snapshot = SharedSnapshot.open(path, siteid, revision)
+            return snapshot
+        finally:
+            lock.close()
+
+
+shared_snapshots = SharedSnapshots()
+request_started.connect(shared_snapshots.mark_stale)
+setting_changed.connect(shared_snapshots.mark_stale)
+signals.settings_revision_changed.connect(shared_snapshots.mark_stale)
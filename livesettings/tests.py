@@ -1,5 +1,8 @@
+import json
 import logging
+from unittest import skipUnless
 
+import django
 import keyedcache
 
 import livesettings
@@ -9,7 +12,9 @@ from django.test.utils import override_settings
 from django.urls import reverse
 from livesettings.functions import config_register, config_exists, \
     config_register_list, config_get, ConfigurationSettings, config_add_choice, \
-    config_choice_values, config_value, config_get_group, config_collect_values
+    config_choice_values, config_value, config_get_group, config_collect_values, \
+    config_values_many
+from livesettings import conf
 from livesettings.models import SettingNotSet, LongSetting
 from livesettings.values import IntegerValue, BASE_GROUP, StringValue, \
     ConfigurationGroup, BooleanValue, MultipleStringValue, LongStringValue, \
@@ -128,6 +133,108 @@ class ConfigTestDotAccess(TestCase):
         self.assertEqual(d, {'s1': True, 's2': 100})
 
 
+class ConfigTestNamespace(TestCase):
+    def setUp(self):
+        # clear out cache from previous runs
+        keyedcache.cache_delete()
+
+        g = ConfigurationGroup('nsgroup', 'Namespace group')
+        self.g = g
+        self.c1 = config_register(BooleanValue(g, 's1', default=True))
+        self.c2 = config_register(IntegerValue(g, 's2', default=10))
+        self.c3 = config_register(MultipleStringValue(g, 's3', default=['a']))
+        self.c4 = config_register(StringValue(g, 's4', default='plain', localized=True))
+        conf.refresh()
+
+    def testTypedAccess(self):
+        self.assertIs(conf.nsgroup.s1, True)
+        self.assertEqual(conf.nsgroup.s2, 10)
+        self.assertEqual(conf.nsgroup.s3, ['a'])
+        self.assertIs(conf.settings.nsgroup, conf.nsgroup)
+
+    def testUpdate(self):
+        self.assertEqual(conf.nsgroup.s2, 10)
+        self.c2.update(100)
+        self.assertEqual(conf.nsgroup.s2, 100)
+        self.c3.update(['b', 'c'])
+        self.assertEqual(conf.nsgroup.s3, ['b', 'c'])
+
+    def testLocalized(self):
+        from django.utils import translation
+        with translation.override('de'):
+            self.c4.update('deutsch')
+            self.assertEqual(conf.nsgroup.s4, 'deutsch')
+        with translation.override('fr'):
+            self.assertEqual(conf.nsgroup.s4, 'plain')
+
+    def testRegisterLater(self):
+        self.assertEqual(conf.nsgroup.s2, 10)
+        config_register(IntegerValue(self.g, 's5', default=5))
+        self.assertEqual(conf.nsgroup.s5, 5)
+        self.assertIn('s5', list(conf.nsgroup))
+
+    def testMissing(self):
+        self.assertRaises(AttributeError, getattr, conf, 'nosuchgroup')
+        self.assertRaises(AttributeError, getattr, conf.nsgroup, 'nosuchkey')
+
+    def testReadOnly(self):
+        def assign():
+            conf.nsgroup.s2 = 5
+        self.assertRaises(AttributeError, assign)
+
+
+class ConfigTestLocalized(TestCase):
+    def setUp(self):
+        # clear out cache from previous runs
+        keyedcache.cache_delete()
+
+        g = ConfigurationGroup('locgroup', 'Localized group')
+        self.c = config_register(StringValue(g, 'greeting', default='hi', localized=True))
+
+    def testStorageKeys(self):
+        self.assertEqual(self.c.storage_key('pt-br'), 'greeting_PT_BR')
+        self.assertEqual(self.c.storage_keys('pt-br'), ('greeting_PT_BR', 'greeting_PT', 'greeting_EN_US', 'greeting_EN'))
+        self.assertEqual(self.c.storage_keys('en'), ('greeting_EN', 'greeting_EN_US'))
+
+    def testFallback(self):
+        from django.utils import translation
+        with translation.override('pt-br'):
+            self.assertEqual(self.c.value, 'hi')
+        with translation.override('en-us'):
+            self.c.update('hello')
+        with translation.override('pt-br'):
+            self.assertEqual(self.c.value, 'hello')
+        with translation.override('pt'):
+            self.c.update('ola')
+        with translation.override('pt-br'):
+            self.assertEqual(self.c.value, 'ola')
+            self.assertEqual(config_values_many([('locgroup', 'greeting')]), {('locgroup', 'greeting'): 'ola'})
+            self.c.update('oi')
+            self.assertEqual(self.c.value, 'oi')
+            self.assertEqual(self.c.setting.key, 'greeting_PT_BR')
+        with translation.override('pt'):
+            self.assertEqual(self.c.value, 'ola')
+
+    def testResetToDefault(self):
+        from django.utils import translation
+        from livesettings.models import Setting
+        with translation.override('en'):
+            self.c.update('hello')
+        with translation.override('pt'):
+            # the default is stored, or pt would fall back to en
+            self.assertTrue(self.c.update('hi'))
+            self.assertEqual(self.c.value, 'hi')
+            self.assertEqual(self.c.setting.value, 'hi')
+            self.assertTrue(self.c.update('ola'))
+            self.assertTrue(self.c.update('hi'))
+            self.assertEqual(self.c.value, 'hi')
+        with translation.override('en'):
+            self.assertTrue(self.c.update('hi'))
+            self.assertEqual(self.c.value, 'hi')
+        self.assertEqual(list(Setting.objects.filter(group='locgroup').values_list('key', 'value')),
+                         [('greeting_PT', 'hi')])
+
+
 class ConfigTestModuleValue(TestCase):
     def setUp(self):
         # clear out cache from previous runs
@@ -143,6 +250,35 @@ class ConfigTestModuleValue(TestCase):
 
         self.assertTrue(hasattr(self.c.value, 'get_version'))
 
+    def testCachedModules(self):
+        import django.utils
+        self.c.update('django')
+        self.assertIs(self.c.value, self.c.value)
+        self.assertIs(self.c.load_module('utils'), django.utils)
+        self.assertIs(self.c._modules[('django', 'utils')], django.utils)
+
+    def testBrokenModule(self):
+        from django.core.exceptions import ImproperlyConfigured
+        from django import forms
+        self.assertRaises(ImproperlyConfigured, self.c.update, 'livesettings.no_such_module')
+        self.assertRaises(ImproperlyConfigured, self.c.to_python, 'livesettings.no_such_module')
+        field = self.c.make_field()
+        self.assertRaises(forms.ValidationError, field.clean, 'livesettings.no_such_module')
+        self.assertEqual(field.clean('django'), 'django')
+
+    def testReplaceBrokenModule(self):
+        from django.core.exceptions import ImproperlyConfigured
+        from livesettings.models import Setting
+        import livesettings.utils
+        # stored before the module was removed
+        Setting.objects.create(site_id=1, group='modules', key='test', value='livesettings.gone')
+        self.assertRaises(ImproperlyConfigured, getattr, self.c, 'value')
+        with self.assertLogs('configuration', 'WARNING') as logs:
+            self.assertTrue(self.c.update(livesettings.utils))
+        self.assertIn('Replacing the unreadable setting modules.test', logs.output[0])
+        self.assertIs(self.c.value, livesettings.utils)
+        self.assertEqual(Setting.objects.get(group='modules', key='test').value, 'livesettings.utils')
+
 
 class ConfigTestSortOrder(TestCase):
     def setUp(self):
@@ -198,6 +334,13 @@ class TestMultipleValues(TestCase):
         c = config_get('m1', 'c1')
         self.assertEqual(c.choices, ((1, 'one'), (2, 'two'), (3, 'three'), (4, 'four')))
 
+    def testAddChoices(self):
+        config_add_choice('m1', 'c1', (4, 'four'), (2, 'deux'), 5)
+        c = config_get('m1', 'c1')
+        self.assertEqual(c.choices, ((1, 'one'), (2, 'two'), (3, 'three'), (4, 'four'), (5, 5)))
+        self.assertEqual(c.choice_label(2), 'two')
+        self.assertEqual(c.choice_label(6), None)
+
     def testChoiceValues(self):
         self.g1c1.update([1, 2])
 
@@ -243,6 +386,18 @@ class ConfigTestChoices(TestCase):
 
         self.assertEqual(c.choices, [('a', 'Item A'), ('b', 'Item B'), ('c', 'Item C')])
 
+    def testAddPreregisteredChoices(self):
+        """Bulk registered choices keep their order and skip duplicates."""
+        config_add_choice('ctg2', 'c1', ('a', 'Item A'), ('b', 'Item B'))
+        config_add_choice('ctg2', 'c1', ('a', 'Other A'), ('c', 'Item C'))
+
+        g1 = ConfigurationGroup('ctg2', 'Choice 2', ordering=1000)
+        config_register(StringValue(g1, 'c1'))
+
+        c = config_get('ctg2', 'c1')
+
+        self.assertEqual(c.choices, [('a', 'Item A'), ('b', 'Item B'), ('c', 'Item C')])
+
 
 class ConfigTestRequires(TestCase):
     def setUp(self):
@@ -277,6 +432,60 @@ class ConfigTestRequires(TestCase):
         self.assertEqual(keys, ['bool1', 'bool2', 'c1', 'c2', 'c3'])
 
 
+class SettingsEditorPrefetchTest(TestCase):
+    def setUp(self):
+        # clear out cache from previous runs
+        keyedcache.cache_delete()
+
+        g = ConfigurationGroup('editorgroup', 'Editor group', ordering=1000)
+        self.g = g
+        self.enable = config_register(BooleanValue(g, 'enable', default=False, ordering=1))
+        self.values = [config_register(IntegerValue(g, 'i%d' % i, default=i, ordering=2)) for i in range(10)]
+        self.required = config_register(IntegerValue(g, 'required', requires=self.enable, ordering=3))
+        self.localized = config_register(StringValue(g, 'loc', localized=True, default='x', ordering=4))
+        self.values[3].update(33)
+        # the group registered first holds the values
+        self.g = config_get_group('editorgroup')
+
+    def testPrefetch(self):
+        from django.contrib.sites.models import Site
+        from livesettings.forms import SettingsEditor
+        Site.objects.get_current()
+        keyedcache.cache_delete()
+
+        with self.assertNumQueries(2):
+            form = SettingsEditor(settings=[self.g])
+
+        self.assertNotIn('editorgroup__required', form.fields)
+        self.assertEqual(form.fields['editorgroup__i3'].initial, '33')
+        self.assertEqual(form.fields['editorgroup__i4'].initial, '4')
+        self.assertEqual(form.fields['editorgroup__loc'].initial, 'x')
+        self.assertEqual(form.groups, [self.g])
+
+        self.enable.update(True)
+        with self.assertNumQueries(0):
+            form = SettingsEditor(settings=[self.g])
+        self.assertIn('editorgroup__required', form.fields)
+
+    def testFieldPrototypes(self):
+        from livesettings.forms import SettingsEditor
+        choices = config_register(MultipleStringValue(self.g, 'choices', choices=[('a', 'A')]))
+
+        form1 = SettingsEditor(settings=[self.g])
+        form2 = SettingsEditor(settings=[self.g])
+        self.assertIs(self.values[0].field_prototype(), self.values[0].field_prototype())
+        self.assertIsNot(form1.fields['editorgroup__i0'], form2.fields['editorgroup__i0'])
+        self.assertIsNot(form1.fields['editorgroup__i0'], self.values[0].field_prototype())
+        self.assertEqual(form1.fields['editorgroup__i0'].label, self.values[0].description)
+        self.assertIs(self.values[0].field_prototype().initial, None)
+
+        prototype = choices.field_prototype()
+        config_add_choice('editorgroup', 'choices', ('b', 'B'))
+        self.assertIsNot(choices.field_prototype(), prototype)
+        form = SettingsEditor(settings=[self.g])
+        self.assertEqual(list(form.fields['editorgroup__choices'].choices), [('a', 'A'), ('b', 'B')])
+
+
 class ConfigTestRequiresChoices(TestCase):
     def setUp(self):
         # clear out cache from previous runs
@@ -467,6 +676,45 @@ class ConfigCollectGroup(TestCase):
 
         self.assertEqual(v, ['set a', 'set d'])
 
+    def testCollectMissing(self):
+        self.choices.update(['coll1', 'nosuchgroup', 'coll3'])
+
+        v = config_collect_values('BASE', 'collect', 'test')
+        self.assertEqual(v, ['set a', 'set d'])
+
+        self.assertRaises(SettingNotSet, config_collect_values, 'BASE', 'collect', 'test', skip_missing=False)
+
+    def testCollectUnhashable(self):
+        g4 = ConfigurationGroup('coll4', 'Collection 4')
+        g5 = ConfigurationGroup('coll5', 'Collection 5')
+        config_register(MultipleStringValue(g4, 'multi')).update(['x', 'y'])
+        config_register(MultipleStringValue(g5, 'multi')).update(['x', 'y'])
+        self.choices.update(['coll4', 'coll5'])
+
+        v = config_collect_values('BASE', 'collect', 'multi')
+        self.assertEqual(v, [['x', 'y']])
+
+    def testCollectAfterUpdate(self):
+        self.assertEqual(config_collect_values('BASE', 'collect', 'test'), ['set a', 'set d'])
+
+        config_get('coll3', 'test').update('set e')
+
+        self.assertEqual(config_collect_values('BASE', 'collect', 'test'), ['set a', 'set e'])
+
+    def testValuesMany(self):
+        v = config_values_many([('coll1', 'test'), ('coll1', 'test1'), ('coll3', 'test')])
+        self.assertEqual(v, {('coll1', 'test'): 'set a', ('coll1', 'test1'): 'set b', ('coll3', 'test'): 'set d'})
+
+        keyedcache.cache_delete()
+        with self.assertNumQueries(1):
+            config_values_many([('coll1', 'test'), ('coll1', 'test1'), ('coll3', 'test')])
+        with self.assertNumQueries(0):
+            config_values_many([('coll1', 'test'), ('coll1', 'test1'), ('coll3', 'test')])
+
+        self.assertRaises(SettingNotSet, config_values_many, [('coll1', 'nosuchkey')])
+        v = config_values_many([('coll1', 'nosuchkey'), ('coll2', 'test')], skip_missing=True)
+        self.assertEqual(v, {('coll2', 'test'): 'set a'})
+
 
 class LongSettingTest(TestCase):
     def setUp(self):
@@ -621,10 +869,53 @@ class PermissionTest(TestCase):
         config_register(val2)
         val2.update(6789)
         response = self.client.get('/settings/export/')
-        self.assertContains(response, "LIVESETTINGS_OPTIONS =", 1)
-        self.assertContains(response, "'DB': False", 1)
-        self.assertContains(response, "'BASE':", 1)
-        self.assertContains(response, "'ModifiedItem': '6789'", 1)
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content).decode('utf-8')  # can be read only once
+        self.assertEqual(content.count("LIVESETTINGS_OPTIONS ="), 1)
+        self.assertEqual(content.count("'DB': False"), 1)
+        self.assertEqual(content.count("'BASE':"), 1)
+        self.assertEqual(content.count("'ModifiedItem': '6789'"), 1)
+
+    def test_export_formats(self):
+        "All sites are exported, in every format"
+        from livesettings.models import Setting, LongSetting, setting_rows
+        from django.contrib.sites.models import Site
+        import gzip
+        site2 = Site.objects.create(domain='other.example.com', name='other')
+        Setting(site=site2, group='BASE', key='Other', value='1').save()
+        LongSetting(site=site2, group='BASE', key='Long', value='x' * 300).save()
+        val2 = IntegerValue(BASE_GROUP, 'ModifiedItem', default=0)
+        config_register(val2)
+        val2.update(6789)
+
+        with self.assertNumQueries(1):
+            rows = list(setting_rows())
+        self.assertEqual([r[:3] for r in rows], [(1, 'BASE', 'ModifiedItem'), (site2.id, 'BASE', 'Long'),
+                                                 (site2.id, 'BASE', 'Other')])
+
+        # a key in both tables is exported once, with the Setting like find_setting reads it
+        LongSetting(site=site2, group='BASE', key='Other', value='y' * 300).save()
+        self.assertEqual([r for r in setting_rows() if r[2] == 'Other'], [(site2.id, 'BASE', 'Other', '1', False)])
+        LongSetting.objects.filter(key='Other').delete()
+
+        self.client.login(username='superuser', password='secret')
+        options = {}
+        exec(b''.join(self.client.get('/settings/export/').streaming_content), options)
+        self.assertEqual(options['LIVESETTINGS_OPTIONS'][site2.id],
+                         {'DB': False, 'SETTINGS': {'BASE': {'Long': 'x' * 300, 'Other': '1'}}})
+
+        response = self.client.get('/settings/export/', {'format': 'json'})
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data['1'], {'DB': False, 'SETTINGS': {'BASE': {'ModifiedItem': '6789'}}})
+
+        response = self.client.get('/settings/export/', {'format': 'ndjson', 'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode('utf-8').splitlines()
+        self.assertEqual(json.loads(lines[1]),
+                         {'site': site2.id, 'group': 'BASE', 'key': 'Long', 'value': 'x' * 300, 'long': True})
+
+        response = self.client.get('/settings/export/', {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
 
     def test_secret_password(self):
         "Verify that password is saved but not re-echoed if render_value=False"
@@ -760,3 +1051,1074 @@ class WebClientPostTest(TestCase):
         # expect 403
         response = csrf_client.post('/settings/', {'Group2__SingleItem': '1234'})
         self.assertContains(response, 'CSRF', status_code=403, msg_prefix='should require csrf')
+
+
+@override_settings(ROOT_URLCONF='livesettings.test_urls', LIVESETTINGS_LAZY_SITE_SETTINGS=True)
+class LazySiteSettingsTest(TestCase):
+    """Tests of the site settings page which loads the groups on demand."""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from collections import OrderedDict
+        self.saved_conf_inst = ConfigurationSettings._ConfigurationSettings__instance.settings
+        ConfigurationSettings.__dict__['_ConfigurationSettings__instance'].settings = OrderedDict()
+
+        keyedcache.cache_delete()
+        user = User.objects.create_user('admin', 'admin@example.com', 'secret')
+        user.is_superuser = True
+        user.save()
+        self.client.login(username='admin', password='secret')
+        self.lazy1 = config_register(IntegerValue(ConfigurationGroup('Lazy1', 'Lazy group 1'), 'first', default=1))
+        self.lazy2 = config_register(IntegerValue(ConfigurationGroup('Lazy2', 'Lazy group 2'), 'second', default=2))
+        self.lazy2.update(2222)
+
+    def tearDown(self):
+        ConfigurationSettings.__dict__['_ConfigurationSettings__instance'].settings = self.saved_conf_inst
+
+    def test_navigation_only(self):
+        response = self.client.get('/settings/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Lazy group 1')
+        self.assertContains(response, reverse('livesettings_group_fragment', args=['Lazy2']))
+        self.assertNotContains(response, 'Lazy2__second')
+        self.assertNotContains(response, '2222')
+
+    def test_fragment(self):
+        response = self.client.get(reverse('livesettings_group_fragment', args=['Lazy2']))
+        self.assertContains(response, 'name="Lazy2__second"')
+        self.assertContains(response, '2222')
+        self.assertContains(response, 'name="livesettings_groups" value="Lazy2"')
+        self.assertNotContains(response, 'Lazy1__first')
+
+        response = self.client.get(reverse('livesettings_group_fragment', args=['NoSuchGroup']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_post_loaded_groups(self):
+        response = self.client.post('/settings/', {'livesettings_groups': ['Lazy1'], 'Lazy1__first': '10'})
+        self.assertRedirects(response, '/settings/')
+        self.assertEqual(self.lazy1.value, 10)
+        self.assertEqual(self.lazy2.value, 2222)
+
+    def test_post_errors(self):
+        response = self.client.post('/settings/', {'livesettings_groups': ['Lazy1'], 'Lazy1__first': 'x'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'name="Lazy1__first"')
+        self.assertNotContains(response, 'name="Lazy2__second"')
+        self.assertEqual(self.lazy1.value, 1)
+
+
+@override_settings(ROOT_URLCONF='livesettings.test_urls')
+class SaveValuesTest(TestCase):
+    """Tests of the JSON endpoint which saves single values."""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        keyedcache.cache_delete()
+        user = User.objects.create_user('admin', 'admin@example.com', 'secret')
+        user.is_superuser = True
+        user.save()
+        self.client.login(username='admin', password='secret')
+        g = ConfigurationGroup('savegroup', 'Save group')
+        self.i1 = config_register(IntegerValue(g, 'i1', default=1))
+        self.i2 = config_register(IntegerValue(g, 'i2', default=2))
+        self.b1 = config_register(BooleanValue(g, 'b1', default=True))
+        self.m1 = config_register(MultipleStringValue(g, 'm1', choices=[('a', 'A'), ('b', 'B')]))
+
+    def test_save_form_encoded(self):
+        response = self.client.post(reverse('livesettings_save'), {'savegroup__i1': '11', 'savegroup__m1': ['a', 'b']})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['values'], {'savegroup__i1': '11', 'savegroup__m1': ['a', 'b']})
+        self.assertEqual(sorted(data['changed']), ['savegroup__i1', 'savegroup__m1'])
+        self.assertEqual(self.i1.value, 11)
+        self.assertEqual(self.i2.value, 2)
+        self.assertEqual(self.m1.value, ['a', 'b'])
+
+    def test_save_json(self):
+        response = self.client.post(reverse('livesettings_save'), {'savegroup__b1': False, 'savegroup__i2': 22},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['values'], {'savegroup__b1': False, 'savegroup__i2': '22'})
+        self.assertFalse(self.b1.value)
+        self.assertEqual(self.i2.value, 22)
+
+        response = self.client.post(reverse('livesettings_save'), {'savegroup__i2': 22},
+                                    content_type='application/json')
+        self.assertEqual(response.json()['changed'], [])
+
+    def test_invalid(self):
+        response = self.client.post(reverse('livesettings_save'), {'savegroup__i1': '11', 'savegroup__i2': 'x'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()['errors']), ['savegroup__i2'])
+        # nothing is saved unless all values are valid
+        self.assertEqual(self.i1.value, 1)
+
+        response = self.client.post(reverse('livesettings_save'), {'savegroup__nosuchkey': '1'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('savegroup__nosuchkey', response.json()['errors'])
+
+        response = self.client.post(reverse('livesettings_save'), 'not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_methods_and_permissions(self):
+        response = self.client.get(reverse('livesettings_save'))
+        self.assertEqual(response.status_code, 405)
+
+        self.client.logout()
+        response = self.client.post(reverse('livesettings_save'), {'savegroup__i1': '11'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.i1.value, 1)
+
+
+@override_settings(ROOT_URLCONF='livesettings.test_urls', LIVESETTINGS_API_GROUPS=['apigroup', 'apigroup2'])
+class SettingsJsonTest(TestCase):
+    """Tests of the read-only JSON settings API."""
+
+    def setUp(self):
+        keyedcache.cache_delete()
+        g = ConfigurationGroup('apigroup', 'API group')
+        self.i1 = config_register(IntegerValue(g, 'i1', default=1))
+        self.m1 = config_register(MultipleStringValue(g, 'm1', default=['a']))
+        self.d1 = config_register(DecimalValue(g, 'd1', default='1.5'))
+        self.mod = config_register(ModuleValue(g, 'mod', default='livesettings'))
+        self.pw = config_register(PasswordValue(g, 'pw', default='secret'))
+        config_register(IntegerValue(ConfigurationGroup('apigroup2', 'API group 2'), 'i2', default=2))
+        config_register(IntegerValue(ConfigurationGroup('apiprivate', 'Private group'), 'i3', default=3))
+
+    def test_group(self):
+        response = self.client.get(reverse('livesettings_json_group', args=['apigroup']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'apigroup': {'i1': 1, 'm1': ['a'], 'd1': '1.5', 'mod': 'livesettings'}})
+        self.assertTrue(response.has_header('ETag'))
+
+    def test_groups(self):
+        response = self.client.get(reverse('livesettings_json'))
+        self.assertEqual(sorted(response.json()), ['apigroup', 'apigroup2'])
+        response = self.client.get(reverse('livesettings_json'), {'groups': 'apigroup2'})
+        self.assertEqual(response.json(), {'apigroup2': {'i2': 2}})
+
+    def test_whitelist(self):
+        response = self.client.get(reverse('livesettings_json_group', args=['apiprivate']))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('livesettings_json'), {'groups': 'apigroup,apiprivate'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_conditional_get(self):
+        url = reverse('livesettings_json_group', args=['apigroup'])
+        etag = self.client.get(url)['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.i1.update(5)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['apigroup']['i1'], 5)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_group_names(self):
+        from django.urls import resolve
+        # the API does not hide groups with its names
+        for name in ('save', 'json', 'api'):
+            self.assertEqual(resolve(reverse('livesettings_group', args=[name])).url_name, 'livesettings_group')
+
+
+class ImportCommandTest(TestCase):
+    """Tests of the livesettings_import management command."""
+
+    def setUp(self):
+        from livesettings.models import Setting
+        keyedcache.cache_delete()
+        g = ConfigurationGroup('importgroup', 'Import group')
+        self.i1 = config_register(IntegerValue(g, 'i1', default=1))
+        self.s1 = config_register(StringValue(g, 's1', default='a'))
+        self.l1 = config_register(LongStringValue(g, 'l1', default=''))
+        self.i1.update(2)
+        self.s1.update('b')
+        Setting(site_id=1, group='importgroup', key='obsolete', value='x').save()
+
+    def run_import(self, content, suffix, *args):
+        import os
+        import tempfile
+        from django.core.management import call_command
+        from io import StringIO
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        out = StringIO()
+        try:
+            call_command('livesettings_import', path, *args, stdout=out)
+        finally:
+            os.remove(path)
+        return out.getvalue()
+
+    def test_import(self):
+        from livesettings.models import Setting
+        content = "LIVESETTINGS_OPTIONS = \\\n" + repr(
+            {1: {'DB': False, 'SETTINGS': {'importgroup': {'i1': '2', 's1': 'c', 'l1': 'long text'}}}})
+        self.assertEqual(self.s1.value, 'b')
+        out = self.run_import(content, '.py')
+        self.assertEqual(out.strip(), 'Site 1: 1 inserted, 1 updated, 1 deleted')
+        self.assertEqual(self.i1.value, 2)
+        self.assertEqual(self.s1.value, 'c')
+        self.assertEqual(self.l1.value, 'long text')
+        self.assertEqual(LongSetting.objects.filter(key='l1').count(), 1)
+        self.assertFalse(Setting.objects.filter(key='obsolete').exists())
+
+        out = self.run_import(content, '.py')
+        self.assertEqual(out.strip(), 'Site 1: 0 inserted, 0 updated, 0 deleted')
+
+    def test_dry_run(self):
+        content = json.dumps({'site': 1, 'group': 'importgroup', 'key': 's1', 'value': 'c', 'long': False}) + '\n'
+        out = self.run_import(content, '.ndjson', '--dry-run')
+        self.assertEqual(out.strip(), 'Site 1: 0 inserted, 1 updated, 2 deleted (dry run)')
+        self.assertEqual(self.s1.value, 'b')
+        self.assertEqual(self.i1.value, 2)
+
+    def test_sites(self):
+        from unittest import mock
+        from django.contrib.sites.models import Site
+        from livesettings import signals
+        site2 = Site.objects.create(domain='import2.example.com', name='import2')
+        content = ''.join(json.dumps({'site': site, 'group': 'importgroup', 'key': 's1', 'value': 'c', 'long': False})
+                          + '\n' for site in (1, site2.id))
+        receiver = mock.Mock()
+        signals.settings_revision_changed.connect(receiver)
+        try:
+            self.run_import(content, '.ndjson')
+        finally:
+            signals.settings_revision_changed.disconnect(receiver)
+        # the cache is invalidated once for all sites
+        self.assertEqual(receiver.call_count, 1)
+        self.assertEqual(self.s1.value, 'c')
+
+    def test_unknown_site(self):
+        from django.core.management.base import CommandError
+        content = json.dumps({'99': {'DB': False, 'SETTINGS': {'importgroup': {'s1': 'c'}}}})
+        self.assertRaises(CommandError, self.run_import, content, '.json')
+        self.assertEqual(self.s1.value, 'b')
+
+
+class SnapshotTest(TestCase):
+    """Tests of compiled settings snapshots."""
+
+    def setUp(self):
+        import tempfile
+        keyedcache.cache_delete()
+        g = ConfigurationGroup('snapgroup', 'Snapshot group')
+        self.s1 = config_register(StringValue(g, 's1', default='a'))
+        self.i1 = config_register(IntegerValue(g, 'i1', default=1))
+        self.s1.update('b')
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+        keyedcache.cache_delete()
+
+    def test_snapshot(self):
+        import os
+        from django.core.management import call_command
+        from io import StringIO
+        path = os.path.join(self.dir, 'settings.snapshot')
+        call_command('livesettings_snapshot', path, stdout=StringIO())
+        self.s1.update('c')
+
+        with override_settings(LIVESETTINGS_SNAPSHOT_FILE=path):
+            keyedcache.cache_delete()
+            with self.assertNumQueries(0):
+                self.assertEqual(config_value('snapgroup', 's1'), 'b')
+                self.assertEqual(config_value('snapgroup', 'i1'), 1)
+
+            with override_settings(LIVESETTINGS_OPTIONS={1: {'DB': True, 'SETTINGS': {}}}):
+                keyedcache.cache_delete()
+                self.assertEqual(config_value('snapgroup', 's1'), 'c')
+
+    def test_invalid(self):
+        import os
+        from django.core.exceptions import ImproperlyConfigured
+        path = os.path.join(self.dir, 'invalid.snapshot')
+        with open(path, 'wb') as f:
+            f.write(b'LIVESETTINGS_OPTIONS = {}')
+        with override_settings(LIVESETTINGS_SNAPSHOT_FILE=path):
+            self.assertRaises(ImproperlyConfigured, config_value, 'snapgroup', 's1')
+
+
+class SharedSnapshotTest(TestCase):
+    """Tests of the snapshots shared by the processes of a host."""
+
+    def setUp(self):
+        import tempfile
+        keyedcache.cache_delete()
+        g = ConfigurationGroup('sharedgroup', 'Shared group')
+        self.s1 = config_register(StringValue(g, 's1', default='a'))
+        self.l1 = config_register(LongStringValue(g, 'l1', default=''))
+        self.s1.update('b')
+        self.l1.update('long é')
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+
+    def test_shared(self):
+        import os
+        from livesettings.snapshot import shared_snapshots
+        with override_settings(LIVESETTINGS_SHARED_SNAPSHOT_DIR=self.dir):
+            self.assertEqual(self.s1.value, 'b')
+            self.assertTrue(os.path.exists(os.path.join(self.dir, 'site-1.snapshot')))
+
+            # another process of the host, with the same revision
+            shared_snapshots.memo = (shared_snapshots.revision, {})
+            keyedcache.cache_delete('Setting', 1, 'sharedgroup', 's1')
+            with self.assertNumQueries(0):
+                self.assertEqual(self.s1.value, 'b')
+                self.assertEqual(self.l1.value, 'long é')
+                self.assertEqual(config_values_many([('sharedgroup', 's1'), ('sharedgroup', 'l1')]),
+                                 {('sharedgroup', 's1'): 'b', ('sharedgroup', 'l1'): 'long é'})
+
+            # writes use the database, the next revision is written again
+            self.s1.update('c')
+            self.assertEqual(self.s1.value, 'c')
+            self.assertEqual(LongSetting.objects.count(), 1)
+            self.l1.update('')
+            self.assertEqual(self.l1.value, '')
+            self.assertEqual(LongSetting.objects.count(), 0)
+
+    def test_host_revision(self):
+        from unittest import mock
+        from livesettings.models import bump_settings_revision
+        from livesettings.snapshot import SharedSnapshot, _read_host_revision, shared_snapshots
+        with override_settings(LIVESETTINGS_SHARED_SNAPSHOT_DIR=self.dir):
+            self.assertEqual(self.s1.value, 'b')
+            with mock.patch.object(SharedSnapshot, 'write') as write:
+                # another worker of the host, with its own cache and settings revision
+                keyedcache.cache_delete()
+                bump_settings_revision()
+                shared_snapshots.memo = (None, {})
+                with self.assertNumQueries(0):
+                    self.assertEqual(self.s1.value, 'b')
+                write.assert_not_called()
+
+            # the change log is polled by every worker, the first one starts a new host revision
+            token = _read_host_revision(self.dir)[1]
+            shared_snapshots.bump(change_id=5)
+            self.assertEqual(_read_host_revision(self.dir)[0], 5)
+            self.assertNotEqual(_read_host_revision(self.dir)[1], token)
+            token = _read_host_revision(self.dir)[1]
+            shared_snapshots.bump(change_id=5)
+            self.assertEqual(_read_host_revision(self.dir), (5, token))
+
+    def test_revision_on_commit(self):
+        from livesettings.snapshot import _read_host_revision, shared_snapshots
+        with override_settings(LIVESETTINGS_SHARED_SNAPSHOT_DIR=self.dir):
+            self.assertEqual(self.s1.value, 'b')
+            token = _read_host_revision(self.dir)[1]
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.s1.update('c')
+            # before the commit the other workers keep the snapshot, this one reads its change without it
+            self.assertEqual(_read_host_revision(self.dir)[1], token)
+            self.assertIsNone(shared_snapshots.get(1))
+            self.assertEqual(self.s1.value, 'c')
+
+            for callback in callbacks:
+                callback()
+            self.assertNotEqual(_read_host_revision(self.dir)[1], token)
+            self.assertEqual(shared_snapshots.get(1).get('sharedgroup', 's1').value, 'c')
+
+    def test_setting_wins(self):
+        import os
+        from livesettings.models import Setting
+        from livesettings.snapshot import SharedSnapshot
+        LongSetting.objects.create(site_id=1, group='sharedgroup', key='s1', value='long')
+        path = os.path.join(self.dir, 'site-1.snapshot')
+        SharedSnapshot.write(path, 1, 'f' * 32)
+        snapshot = SharedSnapshot.open(path, 1, 'f' * 32)
+        self.assertIsInstance(snapshot.get('sharedgroup', 's1'), Setting)
+        self.assertEqual(snapshot.get('sharedgroup', 's1').value, 'b')
+        self.assertIsInstance(snapshot.get('sharedgroup', 'l1'), LongSetting)
+
+
+class PreloadTest(TestCase):
+    """Tests of preloading the settings before forking."""
+
+    def setUp(self):
+        keyedcache.cache_delete()
+        g = ConfigurationGroup('preloadgroup', 'Preload group')
+        self.s1 = config_register(StringValue(g, 's1', default='a'))
+        self.s2 = config_register(StringValue(g, 's2', default='x'))
+        self.loc = config_register(StringValue(g, 'loc', default='hi', localized=True))
+        self.s1.update('b')
+        keyedcache.cache_delete()
+
+    def test_preload(self):
+        from unittest import mock
+        from django.db import connections
+        from livesettings.functions import _after_fork
+        with mock.patch('gc.freeze') as freeze, \
+                mock.patch.object(connections, 'close_all') as close_all:
+            livesettings.preload()
+        freeze.assert_called_once_with()
+        # before the fork
+        close_all.assert_called_once_with()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(config_value('preloadgroup', 's1'), 'b')
+            self.assertEqual(config_value('preloadgroup', 's2'), 'x')
+            self.assertEqual(config_value('preloadgroup', 'loc'), 'hi')
+            self.assertEqual(conf.preloadgroup.s1, 'b')
+
+        conf.resolver.stale = False
+        _after_fork()
+        self.assertTrue(conf.resolver.stale)
+
+
+class AsyncConfigValueTest(TestCase):
+    """Tests of the async read API."""
+
+    def setUp(self):
+        keyedcache.cache_delete()
+        g = ConfigurationGroup('asyncgroup', 'Async group')
+        self.s1 = config_register(StringValue(g, 's1', default='a'))
+        self.i1 = config_register(IntegerValue(g, 'i1', default=1))
+        self.l1 = config_register(LongStringValue(g, 'l1', default=''))
+        self.loc = config_register(StringValue(g, 'loc', default='hi', localized=True))
+        self.s1.update('b')
+        self.l1.update('long')
+        self.loc.update('ola', language_code='pt')
+        keyedcache.cache_delete()
+
+    async def test_aconfig_value(self):
+        from livesettings.functions import aconfig_value
+        self.assertEqual(await aconfig_value('asyncgroup', 's1'), 'b')
+        self.assertEqual(await aconfig_value('asyncgroup', 'i1'), 1)
+        self.assertEqual(await aconfig_value('asyncgroup', 'l1'), 'long')
+        self.assertEqual(await aconfig_value('asyncgroup', 'missing', default=3), 3)
+        with self.assertRaises(SettingNotSet):
+            await aconfig_value('asyncgroup', 'missing')
+
+    async def test_aconfig_values_many(self):
+        from asgiref.sync import sync_to_async
+        from django.utils import translation
+        from livesettings.functions import aconfig_values_many
+        keys = [('asyncgroup', 's1'), ('asyncgroup', 'i1'), ('asyncgroup', 'loc'), ('asyncgroup', 'missing')]
+        with translation.override('pt-br'):
+            found = await aconfig_values_many(keys, skip_missing=True)
+        self.assertEqual(found, {('asyncgroup', 's1'): 'b', ('asyncgroup', 'i1'): 1, ('asyncgroup', 'loc'): 'ola'})
+
+        # the async lookup fills the cache for the sync one
+        await sync_to_async(self.assert_cached)()
+
+    def assert_cached(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(config_value('asyncgroup', 's1'), 'b')
+            self.assertEqual(config_value('asyncgroup', 'i1'), 1)
+
+
+@skipUnless(django.VERSION >= (5, 0), 'the async views need Django 5.0 or newer')
+@override_settings(ROOT_URLCONF='livesettings.test_async_urls')
+class AsyncViewsTest(TestCase):
+    """Tests of the async editor and export views."""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        keyedcache.cache_delete()
+        self.user = User.objects.create_superuser('asyncadmin', 'admin@example.com', 'secret')
+        g = ConfigurationGroup('asyncviews', 'Async views')
+        self.i1 = config_register(IntegerValue(g, 'i1', default=1))
+        self.s1 = config_register(StringValue(g, 's1', default='a'))
+        self.s1.update('stored')
+
+    def test_group_settings(self):
+        self.client.force_login(self.user)
+        url = reverse('livesettings_group', args=['asyncviews'])
+        response = self.client.get(url)
+        self.assertContains(response, 'stored')
+        self.assertContains(response, 'name="asyncviews__i1"')
+
+        response = self.client.post(url, {'asyncviews__i1': '5', 'asyncviews__s1': 'stored'})
+        self.assertEqual((response.status_code, response['Location']), (302, url))
+        self.assertEqual(self.i1.value, 5)
+        self.assertContains(self.client.get(url), 'Updated i1 on asyncviews')
+
+        response = self.client.post(url, {'asyncviews__i1': 'x', 'asyncviews__s1': 'stored'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.i1.value, 5)
+
+    def test_permission(self):
+        response = self.client.get(reverse('livesettings_group', args=['asyncviews']))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith(djangosettings.LOGIN_URL))
+
+    async def test_export(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('settings_export'), {'format': 'ndjson'})
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        lines = [json.loads(line) for line in content.decode('utf-8').splitlines()]
+        self.assertIn({'site': 1, 'group': 'asyncviews', 'key': 's1', 'value': 'stored', 'long': False}, lines)
+
+    async def test_aupdate(self):
+        self.assertTrue(await self.i1.aupdate(7))
+        from livesettings.functions import aconfig_value
+        self.assertEqual(await aconfig_value('asyncviews', 'i1'), 7)
+
+
+class RefresherTest(TestCase):
+    """Tests of the background refresher."""
+
+    def setUp(self):
+        keyedcache.cache_delete()
+        g = ConfigurationGroup('refreshgroup', 'Refresh group')
+        self.i1 = config_register(IntegerValue(g, 'i1', default=1))
+        self.s1 = config_register(StringValue(g, 's1', default='a'))
+        self.changes = []
+        livesettings.signals.configuration_value_changed.connect(self.record)
+
+    def tearDown(self):
+        livesettings.signals.configuration_value_changed.disconnect(self.record)
+
+    def record(self, sender, old_value, new_value, setting, refreshed=False, **kwargs):
+        if refreshed:
+            self.changes.append((setting.key, old_value, new_value))
+
+    def test_refresh(self):
+        from livesettings.refresher import Refresher
+        refresher = Refresher(interval=60)
+        self.assertEqual(refresher.refresh(), [])
+        self.assertEqual(refresher.values[('refreshgroup', 'i1')], 1)
+        self.assertEqual(refresher.refresh(), [])
+
+        with self.assertNumQueries(0):
+            for i in range(10):
+                self.assertEqual(conf.refreshgroup.s1, 'a')
+
+        # changed by another process
+        from livesettings.models import Setting
+        Setting.objects.create(group='refreshgroup', key='s1', value='b', site_id=1)
+        keyedcache.cache_delete('Setting', 1, 'refreshgroup', 's1')
+        from livesettings.models import bump_settings_revision
+        bump_settings_revision()
+
+        self.assertEqual(refresher.refresh(), [('refreshgroup', 's1')])
+        self.assertEqual(self.changes, [('s1', 'a', 'b')])
+        with self.assertNumQueries(0):
+            self.assertEqual(conf.refreshgroup.s1, 'b')
+
+    def test_start_stop(self):
+        from livesettings import refresher
+        thread = refresher.start(interval=60)
+        self.assertTrue(thread.is_alive())
+        self.assertIs(refresher.start(), thread)
+        refresher.stop()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+
+class ThreadSafetyTest(TestCase):
+    """Reading values while other threads register and update values."""
+
+    def setUp(self):
+        keyedcache.cache_delete()
+        g = ConfigurationGroup('threadgroup', 'Thread group')
+        self.i1 = config_register(IntegerValue(g, 'i1', default=0))
+        self.c1 = config_register(MultipleStringValue(g, 'c1', choices=[('a', 'A')], default=['a']))
+        # the group which holds the values, it is registered once per process
+        self.group = config_get_group('threadgroup')
+
+    def test_concurrent_reads(self):
+        import sys
+        import threading
+        from django.db import connection
+        updates = 100
+        errors = []
+        started = threading.Barrier(6)
+        done = threading.Event()
+
+        def read_values():
+            value = config_value('threadgroup', 'i1')
+            if not 0 <= value <= updates:
+                errors.append('read %r' % value)
+
+        def read_registry():
+            for cfg in self.group._dict.values():
+                cfg.key
+
+        def read_choices():
+            for key, label in self.c1.choices:
+                if self.c1.choice_label(key) != label:
+                    errors.append('choice %r' % key)
+
+        def reader(read):
+            try:
+                started.wait()
+                while not done.is_set():
+                    read()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        def registrar():
+            try:
+                started.wait()
+                for i in range(200):
+                    config_register(StringValue(self.group, 'reg%s' % i, default=str(i)))
+                    self.c1.add_choice(('c%s' % i, 'C%s' % i))
+            except Exception as e:
+                errors.append(e)
+
+        self.assertEqual(config_value('threadgroup', 'i1'), 0)
+        threads = [threading.Thread(target=reader, args=(read,))
+                   for read in (read_values, read_values, read_registry, read_choices)]
+        threads.append(threading.Thread(target=registrar))
+        # switch threads often, so readers see registrations in progress
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for thread in threads:
+                thread.start()
+            started.wait()
+            for i in range(1, updates + 1):
+                self.i1.update(i)
+        finally:
+            threads[-1].join(30)
+            done.set()
+            for thread in threads:
+                thread.join(30)
+            sys.setswitchinterval(interval)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(config_value('threadgroup', 'i1'), updates)
+        self.assertEqual(config_value('threadgroup', 'reg199'), '199')
+        self.assertIn(('c199', 'C199'), self.c1.choices)
+        self.assertEqual(self.c1.choice_label('c199'), 'C199')
+
+    def test_register_while_iterating(self):
+        # what a reader in another thread sees when a value is registered during its loop
+        keys = []
+        for cfg in self.group._dict.values():
+            keys.append(cfg.key)
+            if cfg.key == 'i1':
+                config_register(StringValue(self.group, 'late', default='x'))
+        self.assertNotIn('late', keys)
+        self.assertIn('late', self.group)
+
+        labels = []
+        for key, label in self.c1.choices:
+            labels.append(label)
+            if label == 'A':
+                self.c1.add_choice(('b', 'B'))
+        self.assertNotIn('B', labels)
+        self.assertEqual(self.c1.choice_label('b'), 'B')
+
+    def test_choice_state(self):
+        items = self.c1._choice_state[0]
+        for i in range(100):
+            self.c1.add_choice(('s%s' % i, 'S%s' % i))
+        # appended in place, not copied per choice
+        self.assertIs(self.c1._choice_state[0], items)
+
+        # a reader which built its caches from an older state stores them late
+        old_state = self.c1._choice_state
+        self.c1.field_prototype()
+        self.c1.add_choice(('late', 'Late'))
+        self.c1._choices_cache = (old_state, [('stale', 'Stale')])
+        self.c1._field_prototype = (old_state,) + self.c1._field_prototype[1:]
+        self.assertIn(('late', 'Late'), self.c1.choices)
+        self.assertNotIn(('stale', 'Stale'), self.c1.choices)
+        self.assertIn(('late', 'Late'), list(self.c1.field_prototype().choices))
+
+
+class ChangeLogTest(TestCase):
+    """Tests of reloading the settings changed by other processes from the change log."""
+
+    def setUp(self):
+        from livesettings import models
+        keyedcache.cache_delete()
+        g = ConfigurationGroup('changegroup', 'Change group')
+        self.s1 = config_register(StringValue(g, 's1', default='a'))
+        self.s2 = config_register(StringValue(g, 's2', default='x'))
+        models._changes = (0, None)
+        self.addCleanup(setattr, models, '_changes', (0, None))
+
+    def change_elsewhere(self, key, value):
+        # like another node: the database and the change log, not this cache
+        from livesettings.models import Setting, SettingChange
+        if not Setting.objects.filter(group='changegroup', key=key).update(value=value):
+            Setting.objects.bulk_create([Setting(site_id=1, group='changegroup', key=key, value=value)])
+        SettingChange.objects.create(site_id=1, group='changegroup', key=key)
+
+    def test_disabled(self):
+        from livesettings.models import SettingChange, poll_changes
+        self.s1.update('b')
+        self.assertFalse(SettingChange.objects.exists())
+        self.assertEqual(poll_changes(), [])
+
+    @override_settings(LIVESETTINGS_CHANGE_POLL_INTERVAL=60)
+    def test_poll(self):
+        from livesettings.models import SettingChange, poll_changes
+        self.assertEqual(poll_changes(), [])
+        self.s1.update('b')
+        self.assertEqual(list(SettingChange.objects.values_list('group', 'key')), [('changegroup', 's1')])
+        self.assertEqual(config_value('changegroup', 's2'), 'x')
+
+        self.change_elsewhere('s1', 'c')
+        self.change_elsewhere('s2', 'y')
+        # not polled again before the interval
+        self.assertEqual(poll_changes(), [])
+        self.assertEqual(config_value('changegroup', 's1'), 'b')
+
+        with self.assertNumQueries(4):
+            self.assertEqual(poll_changes(force=True), [(1, 'changegroup', 's1'), (1, 'changegroup', 's2')])
+        with self.assertNumQueries(0):
+            self.assertEqual(config_value('changegroup', 's1'), 'c')
+            self.assertEqual(config_value('changegroup', 's2'), 'y')
+        with self.assertNumQueries(1):
+            self.assertEqual(poll_changes(force=True), [])
+
+    @override_settings(LIVESETTINGS_CHANGE_POLL_INTERVAL=0)
+    def test_poll_on_read(self):
+        from livesettings.models import Setting, SettingChange
+        self.s1.update('b')
+        self.assertEqual(config_value('changegroup', 's1'), 'b')
+
+        # deleted by another node
+        Setting.objects.filter(group='changegroup', key='s1').delete()
+        SettingChange.objects.create(site_id=1, group='changegroup', key='s1')
+        self.assertEqual(config_value('changegroup', 's1'), 'a')
+
+    @override_settings(LIVESETTINGS_CHANGE_POLL_INTERVAL=0)
+    def test_poll_on_revision(self):
+        from django.core.signals import request_started
+        from livesettings.refresher import Refresher
+        refresher = Refresher(interval=60)
+        self.s1.update('b')
+        self.assertEqual(conf.changegroup.s1, 'b')
+        self.assertEqual(conf.changegroup.s1, 'b')
+        refresher.refresh()
+
+        self.change_elsewhere('s1', 'c')
+        request_started.send(None)
+        self.assertEqual(conf.changegroup.s1, 'c')
+        self.assertEqual(refresher.refresh(), [('changegroup', 's1')])
+        self.assertEqual(refresher.values[('changegroup', 's1')], 'c')
+
+    @override_settings(LIVESETTINGS_CHANGE_POLL_INTERVAL=60, LIVESETTINGS_CHANGE_RETENTION=3600)
+    def test_prune(self):
+        import datetime
+        from django.utils import timezone
+        from livesettings.models import SettingChange
+        self.change_elsewhere('s2', 'y')
+        SettingChange.objects.update(created=timezone.now() - datetime.timedelta(hours=2))
+        self.s1.update('b')
+        self.assertEqual(list(SettingChange.objects.values_list('key', flat=True)), ['s1'])
+
+    @override_settings(LIVESETTINGS_CHANGE_POLL_INTERVAL=60)
+    def test_missed_changes(self):
+        from livesettings.models import SettingChange, poll_changes
+        self.assertEqual(poll_changes(), [])
+        self.assertEqual(config_value('changegroup', 's1'), 'a')
+        self.assertEqual(config_value('changegroup', 's2'), 'x')
+        self.change_elsewhere('s2', 'y')
+        self.change_elsewhere('s1', 'c')
+        # the change of s2 is pruned before this process polls
+        SettingChange.objects.filter(key='s2').delete()
+        self.assertEqual(poll_changes(force=True), [])
+        self.assertEqual(config_value('changegroup', 's1'), 'c')
+        self.assertEqual(config_value('changegroup', 's2'), 'y')
+
+
+class BroadcastTest(TestCase):
+    """Tests of invalidating the caches of the other processes of the host."""
+
+    def setUp(self):
+        import tempfile
+        keyedcache.cache_delete()
+        g = ConfigurationGroup('broadcastgroup', 'Broadcast group')
+        self.s1 = config_register(StringValue(g, 's1', default='a'))
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+
+    def wait_for(self, condition):
+        import time
+        for i in range(200):
+            if condition():
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_publish(self):
+        import os
+        import socket
+        from livesettings import broadcast
+        from livesettings.models import namespaces, settings_revision
+        with override_settings(LIVESETTINGS_BROADCAST_DIR=self.dir):
+            # a sibling process, which shares the cache of this test
+            sibling = broadcast.Listener(self.dir, name='sibling')
+            sibling.start()
+            # a process which died without removing its socket
+            dead = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            dead.bind(os.path.join(self.dir, 'dead.sock'))
+            dead.close()
+            try:
+                self.assertEqual(config_value('broadcastgroup', 's1'), 'a')
+                ck = keyedcache.cache_key(('Setting',) + namespaces.key(1, 'broadcastgroup', 's1'))
+                with self.captureOnCommitCallbacks() as callbacks:
+                    self.s1.update('b')
+                # the broadcast, and the new revision of the committed change
+                self.assertEqual(len(callbacks), 2)
+                self.assertTrue(keyedcache.cache.get(ck))
+
+                revision = settings_revision()
+                callbacks[0]()
+                self.assertTrue(self.wait_for(lambda: keyedcache.cache.get(ck) is None))
+                self.assertTrue(self.wait_for(lambda: settings_revision() != revision))
+                self.assertEqual(sorted(os.listdir(self.dir)), ['sibling.sock'])
+                self.assertEqual(config_value('broadcastgroup', 's1'), 'b')
+            finally:
+                sibling.stop()
+                sibling.join(5)
+            self.assertFalse(sibling.is_alive())
+
+    def test_start(self):
+        from livesettings import broadcast
+        self.assertIsNone(broadcast.start())
+        with override_settings(LIVESETTINGS_BROADCAST_DIR=self.dir):
+            listener = broadcast.start()
+            try:
+                self.assertTrue(listener.is_alive())
+                self.assertIs(broadcast.start(), listener)
+            finally:
+                broadcast.stop()
+            listener.join(5)
+            self.assertFalse(listener.is_alive())
+
+
+class CacheBackendTest(TestCase):
+    """The settings cache backends behave the same."""
+
+    backends = [
+        ('livesettings.cache.KeyedCache', {}),
+        ('livesettings.cache.DjangoCache', {}),
+        ('livesettings.cache.DjangoCache', {'prefix': 'other', 'timeout': 60}),
+        ('livesettings.cache.LocalCache', {'max_entries': 3}),
+    ]
+
+    def setUp(self):
+        keyedcache.cache_delete()
+        g = ConfigurationGroup('cachegroup', 'Cache group')
+        self.s1 = config_register(StringValue(g, 's1', default='a'))
+
+    def test_interface(self):
+        from asgiref.sync import async_to_sync
+        from livesettings.cache import REVISION, get_cache
+        for backend, options in self.backends:
+            with self.subTest(backend=backend, options=options), \
+                    override_settings(LIVESETTINGS_CACHE_BACKEND=backend, LIVESETTINGS_CACHE_OPTIONS=options):
+                cache = get_cache()
+                cache.clear()
+                k1, k2, k3 = (1, 'g', 'k1'), (1, 'g', 'k2'), (2, 'g with spaces', 'k' * 150)
+                self.assertEqual(cache.get_many([k1, k2]), {})
+                cache.set_many({k1: 'v1', k2: None, k3: 'v3'})
+                self.assertEqual(cache.get_many([k1, k2, k3]), {k1: 'v1', k2: None, k3: 'v3'})
+                self.assertEqual(cache.get(k3), 'v3')
+                cache.delete_many([k1, k2])
+                self.assertEqual(cache.get_many([k1, k2, k3]), {k3: 'v3'})
+                self.assertEqual(async_to_sync(cache.aget_many)([k3]), {k3: 'v3'})
+                async_to_sync(cache.aset_many)({k1: 'v1'})
+                self.assertEqual(cache.get(k1), 'v1')
+                self.assertEqual(cache.add(k1, 'other'), 'v1')
+                self.assertEqual(cache.add(k2, 'v2'), 'v2')
+                self.assertEqual(async_to_sync(cache.aadd)(k2, 'other'), 'v2')
+                self.assertEqual(cache.get(k2), 'v2')
+
+                revision = cache.revision()
+                self.assertEqual(cache.revision(), revision)
+                self.assertEqual(cache.get_many([REVISION, k1]), {REVISION: revision, k1: 'v1'})
+                self.assertNotEqual(cache.revision(bump=True), revision)
+                self.assertEqual(async_to_sync(cache.arevision)(), cache.revision())
+
+    def test_sync_django_cache(self):
+        # Django before 4.0 has no async cache methods
+        from asgiref.sync import async_to_sync
+        from django.core.cache import caches
+        from livesettings.cache import DjangoCache
+
+        class SyncCache(object):
+            def __init__(self, cache):
+                for name in ('get', 'get_many', 'set', 'set_many', 'delete_many', 'add'):
+                    setattr(self, name, getattr(cache, name))
+
+        cache = DjangoCache()
+        cache.cache = SyncCache(caches['default'])
+        async_to_sync(cache.aset_many)({(1, 'g', 'k'): 'v'})
+        self.assertEqual(async_to_sync(cache.aget_many)([(1, 'g', 'k')]), {(1, 'g', 'k'): 'v'})
+        self.assertEqual(async_to_sync(cache.arevision)(), cache.revision())
+
+    def test_settings(self):
+        for backend, options in self.backends:
+            with self.subTest(backend=backend, options=options), \
+                    override_settings(LIVESETTINGS_CACHE_BACKEND=backend, LIVESETTINGS_CACHE_OPTIONS=options):
+                self.s1.update('b')
+                with self.assertNumQueries(0):
+                    self.assertEqual(config_value('cachegroup', 's1'), 'b')
+                self.s1.update('a')
+
+    def test_local_lru(self):
+        from livesettings.cache import LocalCache
+        cache = LocalCache(max_entries=2)
+        cache.set_many({1: 'a', 2: 'b'})
+        cache.get(1)
+        cache.set_many({3: 'c'})
+        self.assertEqual(cache.get_many([1, 2, 3]), {1: 'a', 3: 'c'})
+
+    def test_compact_entries(self):
+        import pickle
+        from livesettings.cache import get_cache
+        from livesettings.models import LongSetting, Setting, find_setting, namespaces
+        self.s1.update('b')
+        setting = Setting.objects.get(group='cachegroup', key='s1')
+        ck = namespaces.key(1, 'cachegroup', 's1')
+        self.assertEqual(get_cache().get(ck), (setting.id, 'b', False))
+        self.assertLess(len(pickle.dumps(get_cache().get(ck))), len(pickle.dumps(setting)) / 4)
+
+        with self.assertNumQueries(0):
+            cached = find_setting('cachegroup', 's1')
+        self.assertEqual((type(cached), cached.id, cached.site_id, cached.value), (Setting, setting.id, 1, 'b'))
+        # a rebuilt setting is saved by an update
+        cached.value = 'c'
+        cached.save()
+        self.assertEqual(Setting.objects.filter(group='cachegroup').count(), 1)
+
+        long = LongSetting.objects.create(site_id=1, group='cachegroup', key='l1', value='x' * 300)
+        self.assertEqual(get_cache().get(namespaces.key(1, 'cachegroup', 'l1')), (long.id, 'x' * 300, True))
+        self.assertIsInstance(find_setting('cachegroup', 'l1'), LongSetting)
+
+
+class NamespaceTest(TestCase):
+    """Tests of invalidating the cached settings of a group or a site at once."""
+
+    def setUp(self):
+        from livesettings.models import namespaces
+        keyedcache.cache_delete()
+        # the memoized versions of the flushed cache
+        namespaces.mark_stale()
+        a = ConfigurationGroup('nsgroupa', 'Namespace group A')
+        b = ConfigurationGroup('nsgroupb', 'Namespace group B')
+        self.a1 = config_register(StringValue(a, 'a1', default='x'))
+        self.a2 = config_register(StringValue(a, 'a2', default='x'))
+        self.b1 = config_register(StringValue(b, 'b1', default='x'))
+        for value in (self.a1, self.a2, self.b1):
+            value.update('old')
+
+    def change_in_database(self):
+        # without touching the cache, like a migration
+        from livesettings.models import Setting
+        Setting.objects.filter(group__startswith='nsgroup').update(value='new')
+
+    def values(self):
+        return [config_value('nsgroupa', 'a1'), config_value('nsgroupa', 'a2'), config_value('nsgroupb', 'b1')]
+
+    def test_invalidate_group(self):
+        from livesettings.models import invalidate_settings
+        self.change_in_database()
+        self.assertEqual(self.values(), ['old', 'old', 'old'])
+        invalidate_settings(groups=['nsgroupa'])
+        self.assertEqual(self.values(), ['new', 'new', 'old'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.values(), ['new', 'new', 'old'])
+
+    def test_invalidate_site(self):
+        from livesettings.models import invalidate_settings
+        self.change_in_database()
+        invalidate_settings()
+        self.assertEqual(self.values(), ['new', 'new', 'new'])
+
+    def test_versions_per_revision(self):
+        from unittest import mock
+        from django.core.signals import request_started
+        from livesettings.cache import get_cache
+        from livesettings.models import namespaces
+        self.values()
+        with mock.patch.object(get_cache(), 'get_many', wraps=get_cache().get_many) as get_many:
+            self.values()
+            # one round trip per setting, with the revision
+            self.assertEqual(get_many.call_count, 3)
+            request_started.send(None)
+            self.values()
+            self.assertEqual(get_many.call_count, 6)
+            get_cache().revision(bump=True)
+            self.values()
+            # the versions of the site and of each group are read again, with the first setting of a group
+            self.assertEqual(get_many.call_count, 13)
+        self.assertEqual(namespaces.key(1, 'nsgroupa', 'a1')[:3], (1, 'nsgroupa', 'a1'))
+
+    def test_token_created_elsewhere(self):
+        from unittest import mock
+        from livesettings.cache import get_cache
+        from livesettings.models import namespaces
+        cache = get_cache()
+        cache.delete_many([('ns', 1, 'nsgroupa')])
+        namespaces.mark_stale()
+        add = cache.add
+
+        def add_elsewhere_first(key, value):
+            add(key, 'elsewhere')
+            return add(key, value)
+
+        # the token of the first writer is used by both
+        with mock.patch.object(cache, 'add', side_effect=add_elsewhere_first):
+            self.assertEqual(namespaces.key(1, 'nsgroupa', 'a1')[4], 'elsewhere')
+        self.assertEqual(cache.get(('ns', 1, 'nsgroupa')), 'elsewhere')
+
+    def test_invalidated_elsewhere(self):
+        from livesettings.cache import get_cache
+        from livesettings.refresher import Refresher
+        refresher = Refresher(interval=60)
+        refresher.refresh()
+        self.change_in_database()
+        self.assertEqual(self.values(), ['old', 'old', 'old'])
+
+        # invalidate_settings(groups=['nsgroupa']) in another process, outside of a request
+        get_cache().set_many({('ns', 1, 'nsgroupa'): 'other'})
+        get_cache().revision(bump=True)
+        self.assertEqual(refresher.refresh(), [('nsgroupa', 'a1'), ('nsgroupa', 'a2')])
+        self.assertEqual(self.values(), ['new', 'new', 'old'])
+
+
+class FingerprintTest(TestCase):
+    """Cached settings of a value whose definition changed are not read."""
+
+    def setUp(self):
+        from livesettings.models import namespaces
+        keyedcache.cache_delete()
+        namespaces.mark_stale()
+        self.group = ConfigurationGroup('fpgroup', 'Fingerprint group')
+        self.v1 = config_register(StringValue(self.group, 'v1', default='x'))
+        self.v2 = config_register(StringValue(self.group, 'v2', default='x'))
+        self.v1.update('5')
+        self.v2.update('y')
+
+    def test_changed_definition(self):
+        from livesettings.models import namespaces
+        self.assertEqual(config_value('fpgroup', 'v1'), '5')
+        old_key = namespaces.key(1, 'fpgroup', 'v1')
+
+        # the next deploy
+        config_register(IntegerValue(self.group, 'v1', default=1))
+        self.assertNotEqual(namespaces.key(1, 'fpgroup', 'v1'), old_key)
+        self.assertEqual(config_value('fpgroup', 'v1'), 5)
+        with self.assertNumQueries(0):
+            self.assertEqual(config_value('fpgroup', 'v1'), 5)
+            self.assertEqual(config_value('fpgroup', 'v2'), 'y')
+
+    def test_localized_keys(self):
+        from livesettings.models import namespaces
+        self.assertEqual(namespaces.fingerprint('fpgroup', 'v2_PT_BR'), namespaces.fingerprint('fpgroup', 'v2'))
+        self.assertEqual(namespaces.fingerprint('fpgroup', 'v2_DE'), namespaces.fingerprint('fpgroup', 'v2'))
+        self.assertNotEqual(namespaces.fingerprint('fpgroup', 'v1'), namespaces.fingerprint('fpgroup', 'v2'))
+        self.assertEqual(namespaces.fingerprint('fpgroup', 'unregistered'), '')
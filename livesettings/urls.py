@@ -8,5 +8,9 @@ from livesettings import views
 urlpatterns = [
     re_path(r'^$', views.site_settings, name='satchmo_site_settings'),
     re_path(r'^export/$', views.export_as_python, name='settings_export'),
+    re_path(r'^api/save/$', views.save_values, name='livesettings_save'),
+    re_path(r'^api/json/$', views.settings_json, name='livesettings_json'),
+    re_path(r'^api/json/(?P<group>[^/]+)/$', views.settings_json, name='livesettings_json_group'),
     re_path(r'^(?P<group>[^/]+)/$', views.group_settings, name='livesettings_group'),
+    re_path(r'^(?P<group>[^/]+)/fragment/$', views.group_fragment, name='livesettings_group_fragment'),
 ]
@@ -54,6 +54,28 @@ def load_module(module):
     return module
 
 
+def unique(sequence):
+    """Return the items of `sequence` without duplicates, keeping their order.
+
+    Hashable items are deduplicated with a set, unhashable ones (e.g. lists)
+    fall back to comparing by equality.
+    """
+    seen = set()
+    unhashable = []
+    out = []
+    for item in sequence:
+        try:
+            if item in seen:
+                continue
+            seen.add(item)
+        except TypeError:
+            if item in unhashable:
+                continue
+            unhashable.append(item)
+        out.append(item)
+    return out
+
+
 def get_flat_list(sequence):
     """flatten out a list and return the flat list"""
     flat = []
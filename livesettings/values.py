@@ -12,6 +12,7 @@ from livesettings.widgets import ImageInput, StringArrayWidget
 from collections import OrderedDict as SortedDict
 import json
 
+from asgiref.sync import sync_to_async
 from django import forms
 from django.conf import settings as djangosettings
 from django.core.exceptions import ImproperlyConfigured
@@ -22,11 +23,13 @@ from django.utils.module_loading import import_string
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext, gettext_lazy as _
 from django.utils.translation import get_language as _get_language
-from livesettings.models import find_setting, LongSetting, Setting, SettingNotSet
+from livesettings.models import afind_settings, find_setting, find_settings, LongSetting, Setting, SettingNotSet, \
+    _asafe_get_siteid, _warn_once
 from livesettings.overrides import get_overrides
 from livesettings.utils import load_module, is_string_like, is_list_or_tuple
 import datetime
 import logging
+import threading
 from . import signals
 
 __all__ = ['BASE_GROUP', 'ConfigurationGroup', 'Value', 'BooleanValue', 'DecimalValue', 'DurationValue',
@@ -34,7 +37,10 @@ __all__ = ['BASE_GROUP', 'ConfigurationGroup', 'Value', 'BooleanValue', 'Decimal
            'StringArrayValue', 'StringValue', 'LongStringValue', 'MultipleStringValue', 'LongMultipleStringValue',
            'PasswordValue', 'URLValue', 'ImageValue']
 
-_WARN = {}
+# Serializes changes of the registry: the groups, their values and choices.
+registry_lock = threading.RLock()
+
+# only ever set from True to False, see `models.is_site_initializing`
 try:
     is_setting_initializing
 except:
@@ -53,6 +59,11 @@ def get_language():
     return _get_language() or djangosettings.LANGUAGE_CODE
 
 
+def _generic_language(code):
+    """Return the generic language of a language code, "pt" for "pt-br"."""
+    return code.replace('_', '-').split('-')[0]
+
+
 def format_setting_name(token):
     """Returns string in style in upper case
     with underscores to separate words"""
@@ -63,6 +74,13 @@ def format_setting_name(token):
 
 
 class SortedDotDict(object):
+    """Ordered dictionary with attribute access.
+
+    The dictionary is never changed in place: every change builds a new one
+    and replaces `_dict` by a single assignment, so readers iterate over a
+    consistent version without taking `registry_lock`.
+    """
+
     def __init__(self, *args, **kwargs):
         super(SortedDotDict, self).__init__(*args, **kwargs)
         self._dict = SortedDict()
@@ -94,10 +112,16 @@ class SortedDotDict(object):
         return self._dict[key]
 
     def __setitem__(self, key, value):
-        self._dict[key] = value
+        with registry_lock:
+            d = self._dict.copy()
+            d[key] = value
+            self._dict = d
 
     def __delitem__(self, key):
-        del self._dict[key]
+        with registry_lock:
+            d = self._dict.copy()
+            del d[key]
+            self._dict = d
 
     def keys(self):
         return list(self._dict.keys())
@@ -124,7 +148,7 @@ class SortedDotDict(object):
         return self._dict.get(*args, **kwargs)
 
     def clear(self):
-        return self._dict.clear()
+        self._dict = SortedDict()
 
     def copy(self):
         s = SortedDotDict()
@@ -138,16 +162,31 @@ class SortedDotDict(object):
         return key in self._dict
 
     def pop(self, *args, **kwargs):
-        return self._dict.pop(*args, **kwargs)
+        with registry_lock:
+            d = self._dict.copy()
+            value = d.pop(*args, **kwargs)
+            self._dict = d
+            return value
 
     def popitem(self, *args, **kwargs):
-        return self._dict.popitem(*args, **kwargs)
+        with registry_lock:
+            d = self._dict.copy()
+            item = d.popitem(*args, **kwargs)
+            self._dict = d
+            return item
 
     def setdefault(self, key, default):
-        return self._dict.setdefault(key, default)
+        with registry_lock:
+            if key in self._dict:
+                return self._dict[key]
+            self[key] = default
+            return default
 
     def update(self, d):
-        return self._dict.update(d)
+        with registry_lock:
+            new = self._dict.copy()
+            new.update(d)
+            self._dict = new
 
     def viewitems(self, *args, **kwargs):
         return self._dict.viewitems(*args, **kwargs)
@@ -168,8 +207,9 @@ class SuperGroup(object):
         """adds instance of :class:`ConfigurationGroup`
         to the super group
         """
-        if group not in self.groups:
-            self.groups.append(group)
+        with registry_lock:
+            if group not in self.groups:
+                self.groups = self.groups + [group]
 
 
 BASE_SUPER_GROUP = SuperGroup(_('Main'))
@@ -228,9 +268,10 @@ class ConfigurationGroup(SortedDotDict):
             vals[key] = value
         return vals
 
-    def values(self):
+    def values(self, raw_values=None):
+        """Return the enabled values, `raw_values` as in `Value.enabled`."""
         vals = list(super(ConfigurationGroup, self).values())
-        return [v for v in vals if v.enabled()]
+        return [v for v in vals if v.enabled(raw_values)]
 
 
 BASE_GROUP = ConfigurationGroup('BASE', _('Base Settings'), ordering=0)
@@ -266,6 +307,7 @@ class Value(object):
         self.ordering = kwargs.pop('ordering', 0)
         self.hidden = kwargs.pop('hidden', False)
         self.localized = kwargs.pop('localized', False)
+        self._localized_keys = None
         self.update_callback = kwargs.pop('update_callback', None)
         self.requires = kwargs.pop('requires', None)
         if self.requires:
@@ -310,17 +352,53 @@ class Value(object):
     def __str__(self):
         return f'{self.value} - {self.key}'
 
+    def _get_choices(self):
+        state = self._choice_state
+        cached = self._choices_cache
+        if cached is None or cached[0] is not state:
+            items, count, index, container = state
+            # keep the container type the choices were given in
+            cached = self._choices_cache = (state, container(items[:count]))
+        return cached[1]
+
+    def _set_choices(self, choices):
+        """Replace all choices, rebuilding the key -> label index."""
+        with registry_lock:
+            self._choices_cache = None
+            self._field_prototype = None
+            self._choice_state = ([], 0, {}, tuple if isinstance(choices, tuple) else list)
+            Value.add_choices(self, choices or ())
+
+    choices = property(fget=_get_choices, fset=_set_choices)
+
     def add_choice(self, choice):
         """Add a choice if it doesn't already exist."""
-        if not is_list_or_tuple(choice):
-            choice = (choice, choice)
-        skip = False
-        for k, v in self.choices:
-            if k == choice[0]:
-                skip = True
-                break
-        if not skip:
-            self.choices += (choice,)
+        self.add_choices((choice,))
+
+    def add_choices(self, choices):
+        """Add several choices at once, skipping those which already exist.
+
+        The choices are appended to their list and index in place, and then
+        published as a new state ``(list, count, index, container type)`` by
+        one assignment.  Readers only use the first `count` choices of the
+        state they read, and the choices and form fields built from a state
+        are cached with it, so a cache built from an older state is not used.
+        """
+        with registry_lock:
+            items, count, index, container = self._choice_state
+            for choice in choices:
+                if not is_list_or_tuple(choice):
+                    choice = (choice, choice)
+                if choice[0] not in index:
+                    # the index first: a choice in the list is always in the index
+                    index[choice[0]] = choice[1]
+                    items.append(choice)
+            if len(items) != count:
+                self._choice_state = (items, len(items), index, container)
+
+    def choice_label(self, key, default=None):
+        """Return the label of the choice `key`, or `default` if there is no such choice."""
+        return self._choice_state[2].get(key, default)
 
     def choice_field(self, **kwargs):
         if self.hidden:
@@ -328,15 +406,21 @@ class Value(object):
         return LocalizedChoiceField(choices=self.choices, **kwargs)
 
     def _choice_values(self):
-        choices = self.choices
         vals = self.value
-        return [x for x in choices if x[0] in vals]
+        if is_list_or_tuple(vals):
+            try:
+                vals = set(vals)
+            except TypeError:
+                pass
+        return [x for x in self.choices if x[0] in vals]
 
     choice_values = property(fget=_choice_values)
 
     def copy(self):
         new_value = self.__class__(self.group, self.key)
         new_value.__dict__ = self.__dict__.copy()
+        items, count, index, container = self._choice_state
+        new_value._choice_state = (items[:count], count, index.copy(), container)
         return new_value
 
     def _default_text(self):
@@ -363,13 +447,21 @@ class Value(object):
 
     default_text = property(fget=_default_text)
 
-    def enabled(self):
+    def enabled(self, raw_values=None):
+        """Return True if the value this one requires allows it.
+
+        `raw_values` can be a dict of already loaded raw values, see `load_raw_values`.
+        """
         enabled = False
         try:
             if not self.requires:
                 enabled = True
             else:
-                v = self.requires.value
+                k = (self.requires.group.key, self.requires.key)
+                if raw_values is not None and k in raw_values:
+                    v = self.requires.to_python(raw_values[k])
+                else:
+                    v = self.requires.value
                 if self.requires.choices:
                     enabled = self.requires_value == v or self.requires_value in v
                 elif v:
@@ -394,58 +486,112 @@ class Value(object):
         return field
 
 
+    def field_prototype(self):
+        """Return the form field of this value, without initial data.
+
+        The field is built once per language and set of choices, editors
+        deep-copy it for each form.
+        """
+        language = get_language()
+        state = self._choice_state
+        cached = self._field_prototype
+        if cached is None or cached[0] is not state or cached[1] != language:
+            field = self.make_field(label=self.description, help_text=self.help_text)
+            cached = self._field_prototype = (state, language, field)
+        return cached[2]
+
     def make_setting_with_value(self, value, language_code=None):
         db_value = self.get_db_prep_save(value)
         return self.make_setting(db_value, language_code=language_code)
 
     def make_setting(self, db_value, language_code=None):
         log.debug('new setting %s.%s', self.group.key, self.key)
-        key = self.key
-        if self.localized:
-            key += '_' + format_setting_name(language_code or get_language())
-        return Setting(group=self.group.key, key=key, value=db_value)
+        return Setting(group=self.group.key, key=self.storage_key(language_code), value=db_value)
+
+    def _localized_table(self):
+        """Return the language code -> storage keys table of a localized value.
+
+        Each entry is the fallback chain of storage keys, e.g. for "pt-br" the keys
+        of "pt-br", "pt" and the default language.  It is built for
+        settings.LANGUAGES up front, other language codes are added when used.
+        """
+        table = self._localized_keys
+        if table is None:
+            table = {}
+            for code in [c for c, _name in djangosettings.LANGUAGES] + [djangosettings.LANGUAGE_CODE]:
+                table[code] = self._localized_chain(code)
+            self._localized_keys = table
+        return table
+
+    def _localized_chain(self, code):
+        chain = []
+        for c in (code, _generic_language(code),
+                  djangosettings.LANGUAGE_CODE, _generic_language(djangosettings.LANGUAGE_CODE)):
+            key = self.key + '_' + format_setting_name(c)
+            if key not in chain:
+                chain.append(key)
+        return tuple(chain)
+
+    def storage_keys(self, language_code=None):
+        """Return the keys to read the setting from, in order of preference.
+
+        Localized values fall back to the generic and then the default language.
+        """
+        if not self.localized:
+            return (self.key,)
+        code = language_code or get_language()
+        table = self._localized_table()
+        try:
+            return table[code]
+        except KeyError:
+            chain = table[code] = self._localized_chain(code)
+            return chain
+
+    def storage_key(self, language_code=None):
+        """Return the key the setting is stored with, localized values have one per language."""
+        if not self.localized:
+            return self.key
+        return self.storage_keys(language_code)[0]
 
     def _setting(self):
-        key = self.key
-        if self.localized:
-            key += '_' + format_setting_name(get_language())
-        return find_setting(self.group.key, key)
+        return find_setting(self.group.key, self.storage_key(), shared=False)
 
     setting = property(fget=_setting)
 
+    def _find_setting(self):
+        """Return the setting to read the value from, following the language fallbacks."""
+        keys = self.storage_keys()
+        if len(keys) == 1:
+            return find_setting(self.group.key, keys[0])
+
+        found = find_settings([(self.group.key, key) for key in keys])
+        for key in keys:
+            setting = found.get((self.group.key, key))
+            if setting is not None:
+                return setting
+        raise SettingNotSet(keys[0])
+
+    def _has_fallback_setting(self, language_code=None):
+        """Return True if a localized value would fall back to the setting of another language.
+
+        Then the default is stored for the exact language instead of deleting its setting.
+        """
+        keys = self.storage_keys(language_code)[1:]
+        return bool(keys) and bool(find_settings([(self.group.key, key) for key in keys]))
+
     def _value(self):
         global is_setting_initializing
         use_db, overrides = get_overrides()
 
-        lang = get_language()
-
-        key = self.key
-        if self.localized:
-            key += '_' + format_setting_name(lang)
         if not use_db:
-            try:
-                val = overrides[self.group.key][key]
-            except KeyError:
-                if self.use_default:
-                    val = self.default
-                else:
-                    raise SettingNotSet('%s.%s is not in your LIVESETTINGS_OPTIONS' % (self.group.key, key))
+            val = self._value_from_overrides(overrides)
 
         else:
             try:
-                val = self.setting.value
+                val = self._value_from_setting(self._find_setting(), overrides)
 
             except SettingNotSet as sns:
-                is_setting_initializing = False
-                if self.use_default:
-                    val = self.default
-                    if overrides:
-                        # maybe override the default
-                        grp = overrides.get(self.group.key, {})
-                        if self.key in grp:
-                            val = grp[self.key]
-                else:
-                    val = NOTSET
+                val = self._value_from_setting(None, overrides)
 
             except AttributeError as ae:
                 is_setting_initializing = False
@@ -454,12 +600,9 @@ class Value(object):
                 raise (ae)
 
             except Exception as e:
-                global _WARN
                 if is_setting_initializing and isinstance(e, DatabaseError) and str(e).find(
                         "livesettings_setting") > -1:
-                    if 'livesettings_setting' not in _WARN:
-                        log.warning(str(e).strip())
-                        _WARN['livesettings_setting'] = True
+                    _warn_once('livesettings_setting', str(e).strip())
                     log.warning('Error loading livesettings from table, OK if you are in syncdb or before it. ROLLBACK')
                     connection._rollback()
 
@@ -474,18 +617,51 @@ class Value(object):
                     traceback.print_exc()
                     log.error("Problem finding settings %s.%s, %s", self.group.key, self.key, e)
                     raise SettingNotSet("Startup error, couldn't load %s.%s" % (self.group.key, self.key))
-            else:
-                is_setting_initializing = False
+        return val
+
+    def _value_from_overrides(self, overrides):
+        """Return the raw value when livesettings is locked down to LIVESETTINGS_OPTIONS."""
+        grp = overrides.get(self.group.key, {})
+        keys = self.storage_keys()
+        for key in keys:
+            if key in grp:
+                return grp[key]
+        if self.use_default:
+            return self.default
+        raise SettingNotSet('%s.%s is not in your LIVESETTINGS_OPTIONS' % (self.group.key, keys[0]))
+
+    def _value_from_setting(self, setting, overrides):
+        """Return the raw value of a found setting, or the default if `setting` is None."""
+        global is_setting_initializing
+        is_setting_initializing = False
+        if setting is not None:
+            return setting.value
+
+        if self.use_default:
+            val = self.default
+            if overrides:
+                # maybe override the default
+                grp = overrides.get(self.group.key, {})
+                if self.key in grp:
+                    val = grp[self.key]
+        else:
+            val = NOTSET
         return val
 
     def update(self, value, language_code=None):
         use_db, overrides = get_overrides()
 
         if use_db:
-            current_value = self.value
+            try:
+                current_value = self.value
+                unreadable = False
+            except ImproperlyConfigured as e:
+                # e.g. a stored module which can not be imported any more, any new value replaces it
+                log.warning("Replacing the unreadable setting %s.%s: %s", self.group.key, self.key, e)
+                current_value, unreadable = None, True
 
             new_value = self.to_python(value)
-            if current_value != new_value:
+            if unreadable or current_value != new_value:
                 if self.update_callback:
                     new_value = self.update_callback(*(current_value, new_value))
 
@@ -498,7 +674,8 @@ class Value(object):
                 except SettingNotSet:
                     s = self.make_setting(db_value, language_code=language_code)
 
-                if self.use_default and self.to_python(self.default) == self.to_python(new_value):
+                if self.use_default and self.to_python(self.default) == self.to_python(new_value) \
+                        and not self._has_fallback_setting(language_code):
                     if s.id:
                         log.info("Deleted setting %s.%s", self.group.key, self.key)
                         s.delete()
@@ -515,6 +692,10 @@ class Value(object):
 
         return False
 
+    async def aupdate(self, value, language_code=None):
+        """Async `update`, the setting is saved in a thread."""
+        return await sync_to_async(self.update)(value, language_code=language_code)
+
     @property
     def value(self):
         val = self._value()
@@ -545,6 +726,67 @@ class Value(object):
             return NOTSET  # TODO this was not a good idea for an editor: "<object object 0x123..>"
         return str(value)
 
+    def to_json(self, value):
+        "Returns a value which can be encoded by DjangoJSONEncoder"
+        return self.to_python(value)
+
+
+def _storage_plan(cfgs):
+    """Return {(group key, key): storage keys} of the values and the set of (group key, storage key) to find."""
+    keys = dict(((cfg.group.key, cfg.key), cfg.storage_keys()) for cfg in cfgs)
+    lookup = set((group, key) for (group, _key), storage_keys in keys.items() for key in storage_keys)
+    return keys, lookup
+
+
+def _resolve_raw_values(cfgs, keys, found, overrides):
+    raw = {}
+    for cfg in cfgs:
+        k = (cfg.group.key, cfg.key)
+        setting = None
+        for key in keys[k]:
+            setting = found.get((cfg.group.key, key))
+            if setting is not None:
+                break
+        raw[k] = cfg._value_from_setting(setting, overrides)
+    return raw
+
+
+def _override_raw_values(cfgs, overrides):
+    return dict(((cfg.group.key, cfg.key), cfg._value_from_overrides(overrides)) for cfg in cfgs)
+
+
+def load_raw_values(cfgs):
+    """Return a dict of (group key, key) -> raw value for several `Value` objects.
+
+    The values are resolved like `Value._value`, but all stored settings are
+    looked up with one `find_settings` call.
+    """
+    use_db, overrides = get_overrides()
+    if not use_db:
+        return _override_raw_values(cfgs, overrides)
+
+    keys, lookup = _storage_plan(cfgs)
+    try:
+        found = find_settings(lookup)
+    except DatabaseError:
+        if not is_setting_initializing:
+            raise
+        # the startup errors are reported and handled value by value
+        connection._rollback()
+        return dict(((cfg.group.key, cfg.key), cfg._value()) for cfg in cfgs)
+
+    return _resolve_raw_values(cfgs, keys, found, overrides)
+
+
+async def aload_raw_values(cfgs):
+    """Async `load_raw_values`, which does not block the event loop on the cache or the database."""
+    use_db, overrides = get_overrides(await _asafe_get_siteid(None))
+    if not use_db:
+        return _override_raw_values(cfgs, overrides)
+
+    keys, lookup = _storage_plan(cfgs)
+    return _resolve_raw_values(cfgs, keys, await afind_settings(lookup), overrides)
+
 
 ###############
 # VALUE TYPES #
@@ -558,7 +800,7 @@ class BooleanValue(Value):
             kwargs.pop('default', None)
             forms.BooleanField.__init__(self, *args, **kwargs)
 
-    def add_choice(self, choice):
+    def add_choices(self, choices):
         # ignore choice adding for boolean types
         pass
 
@@ -826,10 +1068,7 @@ class LongStringValue(Value):
 
     def make_setting(self, db_value, language_code=None):
         log.debug('new long setting %s.%s', self.group.key, self.key)
-        key = self.key
-        if self.localized:
-            key += '_' + format_setting_name(language_code or get_language())
-        return LongSetting(group=self.group.key, key=key, value=db_value)
+        return LongSetting(group=self.group.key, key=self.storage_key(language_code), value=db_value)
 
     def to_python(self, value):
         if value == NOTSET:
@@ -1010,22 +1249,49 @@ class ModuleValue(Value):
             kwargs.pop('default', None)
             forms.CharField.__init__(self, *args, **kwargs)
 
+        def clean(self, value):
+            value = super(ModuleValue.field, self).clean(value)
+            if value:
+                try:
+                    load_module(value)
+                except ImportError as e:
+                    raise forms.ValidationError(_('Can not import module %(module)s: %(error)s')
+                                                % {'module': value, 'error': e})
+            return value
+
+    def __init__(self, *args, **kwargs):
+        super(ModuleValue, self).__init__(*args, **kwargs)
+        # stored module name (or (name, child) pair) -> imported module
+        self._modules = {}
+
+    def _import(self, k, name):
+        try:
+            module = load_module(name)
+        except ImportError as e:
+            raise ImproperlyConfigured("%s.%s: can not import module %s: %s" % (self.group.key, self.key, name, e))
+        self._modules[k] = module
+        return module
+
     def load_module(self, module):
         """Load a child module"""
         value = self._value()
         if value == NOTSET:
             raise SettingNotSet(f"{self.group.key}.{self.key}")
-        return load_module("%s.%s" % (value, module))
+        try:
+            return self._modules[(value, module)]
+        except KeyError:
+            return self._import((value, module), "%s.%s" % (value, module))
 
     def to_python(self, value):
         if value in (NOTSET, ''):
-            v = {}  # TODO this was probably not a good idea
-        else:
-            try:
-                v = load_module(value)
-            except ImportError:
-                v = ''
-        return v
+            return {}  # TODO this was probably not a good idea
+        if not is_string_like(value):
+            # already a module
+            return value
+        try:
+            return self._modules[value]
+        except KeyError:
+            return self._import(value, value)
 
     def get_db_prep_save(self, value):
         return getattr(value, '__name__', '')
@@ -1034,3 +1300,5 @@ class ModuleValue(Value):
         if value == NOTSET:
             value = ""
         return value
+
+    to_json = to_editor
@@ -1,93 +1,154 @@
+import asyncio
+import functools
+import hashlib
+import itertools
+import json
 import logging
+import zlib
 
+from asgiref.sync import sync_to_async
+
+from django.conf import settings as djangosettings
 from django.contrib import messages
 from django.contrib.auth.decorators import permission_required
+from django.contrib.auth.views import redirect_to_login
 from django.contrib.sites.models import Site
-from django.http import HttpResponseRedirect
+from django.core.exceptions import ValidationError
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse, \
+    StreamingHttpResponse
 from django.shortcuts import render
 from django.urls import reverse
-from django.views.decorators.cache import never_cache
+from django.views.decorators.cache import cache_control, never_cache
 from django.views.decorators.csrf import csrf_protect
+from django.views.decorators.http import etag, require_POST, require_safe
 from livesettings import forms
 from livesettings.functions import ConfigurationSettings
+from livesettings.models import SettingNotSet, setting_rows, settings_revision, _asafe_get_siteid, _safe_get_siteid
 from livesettings.overrides import get_overrides
+from livesettings.values import NOTSET, aload_raw_values, get_language
 
 log = logging.getLogger('livesettings.views')
 
 
-@csrf_protect
-def group_settings(request, group, template='livesettings/group_settings.html'):
-    # Determine what set of settings this editor is used for
+def _lazy_site_settings():
+    return getattr(djangosettings, 'LIVESETTINGS_LAZY_SITE_SETTINGS', False)
 
-    use_db, overrides = get_overrides()
 
-    mgr = ConfigurationSettings()
+def _sections(mgr):
+    """Return a list of (super group name, groups) of all registered groups."""
+    sections = []
+    seen = set()
+    for super_group in mgr.get_super_groups():
+        groups = [mgr[g.key] for g in super_group.groups if g.key in mgr and g.key not in seen]
+        seen.update(g.key for g in groups)
+        sections.append((super_group.name, groups))
+    others = [g for g in mgr.groups() if g.key not in seen]
+    if others:
+        sections.append((None, others))
+    return sections
+
 
+def _editor_target(request, group, lazy, mgr):
+    """Return (edited settings, title), or a redirect to the first group."""
     all_super_groups = mgr.get_super_groups()
-    if not group and len(mgr.groups()) > 1:
+    if not group and not lazy and len(mgr.groups()) > 1:
         if len(all_super_groups) > 0:
             default_group = all_super_groups[0].groups[0]
         else:
             default_group = mgr.groups()[0]
         return HttpResponseRedirect(reverse('livesettings_group', args=[default_group.key]))
 
-    if group is None:
+    if group is None and lazy:
+        # Only the groups which were loaded into the page are edited
+        settings = [mgr[k] for k in request.POST.getlist('livesettings_groups') if k in mgr]
+        title = 'Site settings'
+    elif group is None:
         settings = mgr
         title = 'Site settings'
     else:
         settings = mgr[group]
         title = settings.name
         log.debug('title: %s', title)
+    return settings, title
 
-    if use_db:
-        # Create an editor customized for the current user
-        # editor = forms.customized_editor(settings)
 
+def _save_editor(request, form, mgr):
+    """Save the values of a valid settings editor, with a message about each change."""
+    form.full_clean()
+    for name, value in list(form.cleaned_data.items()):
+        group, key = name.split('__')
+        cfg = mgr.get_config(group, key)
+        from livesettings.values import ImageValue
+        if isinstance(cfg, ImageValue):
+            if request.FILES and name in request.FILES:
+                value = request.FILES[name]
+            else:
+                continue
+
+        try:
+            if cfg.update(value):
+                # Give user feedback as to which settings were changed
+                messages.add_message(request, messages.INFO,
+                                     'Updated %s on %s' % (cfg.key, cfg.group.key))
+        except Exception as e:
+            log.exception(f'failed to save setting {name}:={value}')
+            messages.add_message(request, messages.ERROR, str(e))
+
+
+def _editor_context(mgr, group, settings, title, form, use_db, lazy, site_count, site):
+    if lazy:
+        loaded = {}
+        if form is not None:
+            for field in form:
+                loaded.setdefault(field.field.group.key, []).append(field)
+        sections = [(name, [(g, loaded.get(g.key)) for g in groups]) for name, groups in _sections(mgr)]
+    else:
+        sections = None
+
+    return {
+        'all_super_groups': mgr.get_super_groups(),
+        'sections': sections,
+        'has_multiple_groups': len(mgr.groups()) > 1,
+        'has_multiple_sites': site_count > 1,
+        'site_header': f"{site.name} settings",
+        'page_class': 'settings',
+        'title': title,
+        'settings_group': settings,
+        'group': group,
+        'form': form,
+        'use_db': use_db,
+    }
+
+
+@csrf_protect
+def group_settings(request, group, template='livesettings/group_settings.html', lazy=False):
+    # Determine what set of settings this editor is used for
+
+    use_db, overrides = get_overrides()
+
+    mgr = ConfigurationSettings()
+    target = _editor_target(request, group, lazy, mgr)
+    if isinstance(target, HttpResponse):
+        return target
+    settings, title = target
+
+    if use_db:
         if request.method == 'POST':
             # Populate the form with user-submitted data
             data = request.POST.copy()
             form = forms.SettingsEditor(data, request.FILES, settings=settings)
             if form.is_valid():
-                form.full_clean()
-                for name, value in list(form.cleaned_data.items()):
-                    group, key = name.split('__')
-                    cfg = mgr.get_config(group, key)
-                    from livesettings.values import ImageValue
-                    if isinstance(cfg, ImageValue):
-                        if request.FILES and name in request.FILES:
-                            value = request.FILES[name]
-                        else:
-                            continue
-
-                    try:
-                        if cfg.update(value):
-                            # Give user feedback as to which settings were changed
-                            messages.add_message(request, messages.INFO,
-                                                 'Updated %s on %s' % (cfg.key, cfg.group.key))
-                    except Exception as e:
-                        log.exception(f'failed to save setting {name}:={value}')
-                        request.user.message_set.create(message=str(e))
-
+                _save_editor(request, form, mgr)
                 return HttpResponseRedirect(request.path)
         else:
             # Leave the form populated with current setting values
-            # form = editor()
             form = forms.SettingsEditor(settings=settings)
     else:
         form = None
 
-    return render(request, template, {
-        'all_super_groups': all_super_groups,
-        'has_multiple_groups': len(mgr.groups()) > 1,
-        'has_multiple_sites': Site.objects.count() > 1,
-        'site_header': f"{Site.objects.get_current().name} settings",
-        'page_class': 'settings',
-        'title': title,
-        'settings_group': settings,
-        'group': group,
-        'form': form,
-        'use_db': use_db,
-    })
+    context = _editor_context(mgr, group, settings, title, form, use_db, lazy,
+                              Site.objects.count(), Site.objects.get_current())
+    return render(request, template, context)
 
 
 group_settings = never_cache(permission_required('livesettings.change_setting')(group_settings))
@@ -98,30 +159,319 @@ group_settings = never_cache(permission_required('livesettings.change_setting')(
 # Site-wide setting editor is identical, but without a group
 # permission_required is implied, since it calls group_settings
 def site_settings(request):
+    if _lazy_site_settings():
+        return group_settings(request, group=None, template='livesettings/site_settings_lazy.html', lazy=True)
     return group_settings(request, group=None, template='livesettings/site_settings.html')
 
 
+def _apermission_required(perm):
+    """`permission_required` of async views, the user is loaded in a thread."""
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if await sync_to_async(lambda: request.user.has_perm(perm))():
+                return await view(request, *args, **kwargs)
+            return redirect_to_login(request.get_full_path())
+        return wrapper
+    return decorator
+
+
+@csrf_protect
+async def agroup_settings(request, group, template='livesettings/group_settings.html', lazy=False):
+    """Async `group_settings`, the current values and the site are looked up concurrently.
+
+    The changed values are saved by one call in a thread.
+    """
+    use_db, overrides = get_overrides(await _asafe_get_siteid(None))
+
+    mgr = ConfigurationSettings()
+    target = _editor_target(request, group, lazy, mgr)
+    if isinstance(target, HttpResponse):
+        return target
+    settings, title = target
+
+    lookups = [Site.objects.acount(), sync_to_async(Site.objects.get_current)()]
+    if use_db:
+        lookups.append(aload_raw_values(forms.SettingsEditor.values_needed(settings)))
+    found = await asyncio.gather(*lookups)
+    site_count, site = found[:2]
+
+    if use_db:
+        if request.method == 'POST':
+            data = request.POST.copy()
+            form = forms.SettingsEditor(data, request.FILES, settings=settings, raw_values=found[2])
+            if form.is_valid():
+                await sync_to_async(_save_editor)(request, form, mgr)
+                return HttpResponseRedirect(request.path)
+        else:
+            form = forms.SettingsEditor(settings=settings, raw_values=found[2])
+    else:
+        form = None
+
+    context = _editor_context(mgr, group, settings, title, form, use_db, lazy, site_count, site)
+    return await sync_to_async(render)(request, template, context)
+
+
+agroup_settings = never_cache(_apermission_required('livesettings.change_setting')(agroup_settings))
+
+
+async def asite_settings(request):
+    if _lazy_site_settings():
+        return await agroup_settings(request, group=None, template='livesettings/site_settings_lazy.html', lazy=True)
+    return await agroup_settings(request, group=None, template='livesettings/site_settings.html')
+
+
+def group_fragment(request, group):
+    """Render the fields of one group, loaded on demand by the lazy site settings page"""
+    use_db, overrides = get_overrides()
+    mgr = ConfigurationSettings()
+    if not use_db or group not in mgr:
+        raise Http404(group)
+
+    settings = mgr[group]
+    form = forms.SettingsEditor(settings=[settings])
+    return render(request, 'livesettings/group_fragment.html', {
+        'group': settings,
+        'fields': list(form),
+    })
+
+
+group_fragment = never_cache(permission_required('livesettings.change_setting')(group_fragment))
+
+
+@csrf_protect
+@require_POST
+def save_values(request):
+    """Validate and save one or a few values, answer with their new editor values as JSON.
+
+    The values are posted as form fields named `group__key` like in the
+    settings editor, or as a JSON object of the same names.  Nothing is saved
+    unless all of them are valid.
+    """
+    use_db, overrides = get_overrides()
+    if not use_db:
+        return JsonResponse({'errors': {'__all__': ['Livesettings are disabled for this site.']}}, status=400)
+
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({'errors': {'__all__': ['Invalid JSON.']}}, status=400)
+        if not isinstance(data, dict):
+            return JsonResponse({'errors': {'__all__': ['Expected a JSON object.']}}, status=400)
+    else:
+        data = None
+
+    from livesettings.values import ImageValue
+    mgr = ConfigurationSettings()
+    names = data.keys() if data is not None else set(request.POST.keys()) | set(request.FILES.keys())
+    cleaned = []
+    errors = {}
+    for name in names:
+        if name == 'csrfmiddlewaretoken':
+            continue
+        group, sep, key = name.partition('__')
+        try:
+            cfg = mgr.get_config(group, key)
+        except SettingNotSet:
+            errors[name] = ['Unknown setting.']
+            continue
+
+        if isinstance(cfg, ImageValue):
+            if name not in request.FILES:
+                errors[name] = ['Upload the image as a file.']
+                continue
+            cleaned.append((name, cfg, request.FILES[name]))
+            continue
+
+        field = cfg.field_prototype()
+        if data is not None:
+            value = data[name]
+        else:
+            value = field.widget.value_from_datadict(request.POST, request.FILES, name)
+        try:
+            cleaned.append((name, cfg, field.clean(value)))
+        except ValidationError as e:
+            errors[name] = list(e.messages)
+
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
+
+    changed = []
+    result = {}
+    for name, cfg, value in cleaned:
+        try:
+            if cfg.update(value):
+                changed.append(name)
+        except Exception as e:
+            log.exception(f'failed to save setting {name}:={value}')
+            errors[name] = [str(e)]
+            continue
+        value = cfg.editor_value
+        result[name] = None if value is NOTSET else value
+
+    return JsonResponse({'values': result, 'changed': changed, 'errors': errors},
+                        status=400 if errors else 200)
+
+
+save_values = never_cache(permission_required('livesettings.change_setting')(save_values))
+
+
+def _api_groups(request, group):
+    """Return the keys of the groups requested from the JSON API, all must be whitelisted"""
+    allowed = getattr(djangosettings, 'LIVESETTINGS_API_GROUPS', ())
+    if group:
+        keys = [group]
+    elif request.GET.get('groups'):
+        keys = [k for k in request.GET['groups'].split(',') if k]
+    else:
+        keys = list(allowed)
+
+    mgr = ConfigurationSettings()
+    for k in keys:
+        if k not in allowed or k not in mgr:
+            raise Http404(k)
+    return keys
+
+
+def _api_etag(request, group=None):
+    keys = _api_groups(request, group)
+    use_db, overrides = get_overrides()
+    if use_db:
+        state = settings_revision()
+    else:
+        state = json.dumps(dict((k, overrides.get(k)) for k in keys), sort_keys=True)
+    token = '%s|%s|%s|%s|%s' % (state, ConfigurationSettings().generation, _safe_get_siteid(None),
+                                get_language(), ','.join(keys))
+    return hashlib.md5(token.encode('utf-8')).hexdigest()
+
+
+def settings_json(request, group=None):
+    """Effective values of whitelisted groups as JSON, {group: {key: value}}.
+
+    Only the groups in LIVESETTINGS_API_GROUPS are served and password values
+    are left out.  The ETag follows the settings revision, a matching
+    If-None-Match is answered with 304 before any value is read.  Getting
+    the revision still reads the cache, and runs a due poll of the change
+    log, because another process may have changed the settings.
+    """
+    from livesettings.values import PasswordValue, SortedDotDict, load_raw_values
+
+    mgr = ConfigurationSettings()
+    cfgs = [cfg for k in _api_groups(request, group) for cfg in SortedDotDict.values(mgr[k])
+            if not isinstance(cfg, PasswordValue)]
+    raw = load_raw_values(cfgs)
+
+    data = {}
+    for cfg in cfgs:
+        data.setdefault(cfg.group.key, {})[cfg.key] = cfg.to_json(raw[(cfg.group.key, cfg.key)])
+    return JsonResponse(data)
+
+
+settings_json = require_safe(cache_control(no_cache=True)(etag(_api_etag)(settings_json)))
+
+
+def _export_nested(rows, dump, site_key, false):
+    """Yield the literal of {site: {'DB': False, 'SETTINGS': {group: {key: value}}}}."""
+    site = group = None
+    yield '{'
+    for site_id, g, key, value, is_long in rows:
+        if site_id != site:
+            if site is not None:
+                yield '\n            }\n        }\n    },'
+            yield '\n    %s: {\n        %s: %s,\n        %s: {' % (site_key(site_id), dump('DB'), false, dump('SETTINGS'))
+            site, group = site_id, None
+        if g != group:
+            if group is not None:
+                yield '\n            },'
+            yield '\n            %s: {' % dump(g)
+            group, sep = g, ''
+        yield '%s\n                %s: %s' % (sep, dump(key), dump(value))
+        sep = ','
+    if site is not None:
+        yield '\n            }\n        }\n    }'
+    yield '\n}\n'
+
+
+def _export_python(rows):
+    yield 'LIVESETTINGS_OPTIONS = \\\n'
+    for chunk in _export_nested(rows, repr, repr, 'False'):
+        yield chunk
+
+
+def _export_json(rows):
+    return _export_nested(rows, json.dumps, lambda site_id: json.dumps(str(site_id)), 'false')
+
+
+def _export_ndjson(rows):
+    for site_id, group, key, value, is_long in rows:
+        yield json.dumps({'site': site_id, 'group': group, 'key': key, 'value': value, 'long': is_long}) + '\n'
+
+
+# format: (content type, file extension, writer)
+EXPORT_FORMATS = {
+    'python': ('text/plain', 'py', _export_python),
+    'json': ('application/json', 'json', _export_json),
+    'ndjson': ('application/x-ndjson', 'ndjson', _export_ndjson),
+}
+
+
+def _gzip(chunks):
+    z = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = z.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield z.flush()
+
+
+def _export_response(request, wrap=None):
+    format = request.GET.get('format', 'python')
+    if format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest('Unknown export format %s' % format)
+    content_type, extension, writer = EXPORT_FORMATS[format]
+
+    stream = writer(setting_rows())
+    if request.GET.get('gzip'):
+        stream = _gzip(stream)
+        content_type = 'application/gzip'
+    else:
+        content_type += '; charset=utf-8'
+    response = StreamingHttpResponse(wrap(stream) if wrap else stream, content_type=content_type)
+    if request.GET.get('gzip'):
+        response['Content-Disposition'] = 'attachment; filename="livesettings.%s.gz"' % extension
+    return response
+
+
 def export_as_python(request):
-    """Export site settings as a dictionary of dictionaries"""
+    """Export the settings of all sites as a dictionary of dictionaries
+
+    `?format=` is `python` (default, for LIVESETTINGS_OPTIONS), `json` or
+    `ndjson` (one setting per line), `?gzip=1` compresses it.  The rows are
+    streamed, the memory used does not depend on the number of settings.
+    """
+    return _export_response(request)
 
-    from livesettings.models import Setting, LongSetting
-    import pprint
 
-    work = {}
-    both = list(Setting.objects.all())
-    both.extend(list(LongSetting.objects.all()))
+async def _astream(stream, size=200):
+    """Iterate a stream which reads the database, size chunks per call in a thread."""
+    def take():
+        chunks = list(itertools.islice(stream, size))
+        return chunks[0][:0].join(chunks) if chunks else None
 
-    for s in both:
-        sitesettings = work.setdefault(s.site.id, {'DB': False, 'SETTINGS': {}})['SETTINGS']
-        sitegroup = sitesettings.setdefault(s.group, {})
-        sitegroup[s.key] = s.value
+    while True:
+        chunk = await sync_to_async(take)()
+        if chunk is None:
+            break
+        yield chunk
 
-    pp = pprint.PrettyPrinter(indent=4)
-    pretty = pp.pformat(work)
 
-    return render(request, 'livesettings/text.txt', {'text': pretty}, content_type='text/plain')
+async def aexport_as_python(request):
+    """Async `export_as_python`."""
+    return _export_response(request, wrap=_astream)
 
 
 # Required permission `is_superuser` is equivalent to auth.change_user,
 # because who can modify users, can easy became a superuser.
 export_as_python = never_cache(permission_required('auth.change_user')(export_as_python))
+aexport_as_python = never_cache(_apermission_required('auth.change_user')(aexport_as_python))
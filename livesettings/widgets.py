@@ -35,11 +35,12 @@ class StringArrayWidget(forms.TextInput):
 
     def __init__(self, *args, default=None, **kwargs):
         self.default = default
+        self.quoted_default = quote(json.dumps(default))
         super().__init__(*args, **kwargs)
 
     def get_context(self, name, value, attrs):
         """Returns context for rendering"""
         context = super().get_context(name, value, attrs)
         context['value'] = value.strip('"')
-        context['widget']['default'] = quote(json.dumps(self.default))
+        context['widget']['default'] = self.quoted_default
         return context
@@ -141,6 +141,8 @@ CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'TIMEOUT': 5,
+        # the values registered by all tests do not fit into the default 300 entries
+        'OPTIONS': {'MAX_ENTRIES': 100000},
         # It is high recommended to configure a global cache for multiprocess
         # servers, because other processes would not be notified about new
         # values with LocMemCache. !!